@@ -6,13 +6,29 @@ import os
 import time
 import threading
 import ipaddress
-
-from genie.fetcher import fetch_all
-from genie.compressor import compress
-from genie.analyzer import analyze, refine
-from genie.validator import validate, find_multi_matches, narrow_by_first_match
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from genie.fetcher import MAX_SIZE, fetch_all
+from genie.compressor import compile_selector, prepare_sections, compress_section, fingerprint
+from genie.analyzer import MODEL, MODEL_CASCADE, TOKEN_COUNTS, analyze, analyze_stream, generalize_xpath, make_provider, refine, sanitize_wantlist, scope_to_section, select_samples
+from genie.llm import USE_STREAMING, CircuitOpenError
+from genie import cassette, dom_cache, metrics, refine_cache, xpath_cache
+from genie.structured import match_wantlist
+from genie.labels import common_label_pairs, match_labels
+from genie.synonyms import learn, synonym_table
+from genie.synthesis import generalize, marked_context, resolve_target, synthesize
+from genie.template_cache import template_key, lookup, still_valid
+from genie.template_cache import store as store_template
+from genie.validator import validate, validate_field, parse_pages, find_multi_matches, narrow_by_first_match
 
 app = Flask(__name__, static_folder="static", static_url_path="/static")
+# Request bodies (e.g. page HTML sent to /api/generalize) are capped like fetched pages
+app.config["MAX_CONTENT_LENGTH"] = MAX_SIZE
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": f"Request body too large (max {MAX_SIZE // (1024 * 1024)}MB)"}), 413
 
 # Simple rate limiting for API endpoints (thread-safe)
 _rate_limit = {}
@@ -101,6 +117,136 @@ def api_fetch():
         return jsonify({"error": "Failed to fetch URL"}), 500
 
 
+@app.route("/api/metrics")
+def api_metrics():
+    """LLM call / response-parsing counters and XPath compile cache stats since process start."""
+    if not _check_origin():
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify({**metrics.snapshot(), "xpath_cache": xpath_cache.stats()})
+
+
+@app.route("/api/synthesize", methods=["POST"])
+def api_synthesize():
+    """XPaths generalized from known example values (no LLM call).
+
+    Body: {urls, examples: {field: value or [values]}}. Returns validated
+    mappings like /api/analyze, plus the fields no example was found for.
+    """
+    if not _check_origin():
+        return jsonify({"error": "Forbidden"}), 403
+    client_ip = request.headers.get("X-Forwarded-For", request.remote_addr).split(",")[0].strip()
+    if not _check_rate_limit(client_ip):
+        return jsonify({"error": "Rate limit exceeded"}), 429
+    data = request.get_json()
+    if not data or "urls" not in data or not isinstance(data.get("examples"), dict):
+        return jsonify({"error": "urls and examples required"}), 400
+    urls = [u.strip() for u in data["urls"] if isinstance(u, str) and u.strip()]
+    examples = data["examples"]
+    if not urls:
+        return jsonify({"error": "No valid URLs"}), 400
+    if len(urls) > 10:
+        return jsonify({"error": "Max 10 URLs"}), 400
+    if len(examples) > 50 or not all(
+            isinstance(v, str) or (isinstance(v, list) and all(isinstance(x, str) for x in v))
+            for v in examples.values()):
+        return jsonify({"error": "Invalid examples"}), 400
+
+    t0 = time.time()
+    pages = fetch_all(urls)
+    fetched = [p for p in pages if p["html"]]
+    if not fetched:
+        return jsonify({
+            "status": "error",
+            "reason": "fetch_failed",
+            "message": "Failed to fetch all URLs",
+            "details": [p.get("error", "unknown") for p in pages],
+        }), 400
+    docs = parse_pages(pages)
+    mappings = synthesize(examples, docs)
+    containers = {}
+    return jsonify({
+        "status": "ok",
+        "mappings": {field: validate_field(xpath, docs, containers) for field, xpath in mappings.items()},
+        "unresolved": [field for field in examples if field not in mappings],
+        "pages_analyzed": len(fetched),
+        "pages_failed": len(pages) - len(fetched),
+        "tokens_used": 0,
+        "elapsed_seconds": round(time.time() - t0, 3),
+    })
+
+
+@app.route("/api/generalize", methods=["POST"])
+def api_generalize():
+    """Robust XPath for an element clicked in the browser (XPathAbu).
+
+    Body: {xpath, url, html?, urls?} — the raw absolute XPath, the page (sent
+    as HTML, or fetched from url) and optional sibling pages of the same
+    template. Parsed pages are kept in genie.dom_cache between clicks. The
+    LLM is only asked when no label/class-anchored XPath is unique.
+    """
+    if not _check_origin():
+        return jsonify({"error": "Forbidden"}), 403
+    client_ip = request.headers.get("X-Forwarded-For", request.remote_addr).split(",")[0].strip()
+    if not _check_rate_limit(client_ip):
+        return jsonify({"error": "Rate limit exceeded"}), 429
+    data = request.get_json()
+    xpath = (data or {}).get("xpath")
+    url = (data or {}).get("url") or ""
+    html = (data or {}).get("html")
+    siblings = (data or {}).get("urls") or []
+    if not isinstance(xpath, str) or not xpath.strip() or not isinstance(url, str) \
+            or (html is not None and not isinstance(html, str)) or not (html or url.strip()):
+        return jsonify({"error": "xpath and url or html required"}), 400
+    if not isinstance(siblings, list) or not all(isinstance(u, str) for u in siblings) or len(siblings) > 9:
+        return jsonify({"error": "Invalid urls (max 9 sibling pages)"}), 400
+    if html and len(html) > MAX_SIZE:
+        return request_too_large(None)
+
+    t0 = time.time()
+    if html:
+        doc = dom_cache.parsed_html(html)
+        error = None if doc is not None else "HTML could not be parsed"
+    else:
+        _, doc, error = dom_cache.parsed_urls([url.strip()])[0]
+    if doc is None:
+        return jsonify({"status": "error", "reason": "fetch_failed", "message": error}), 400
+    docs = [(url, doc)] + [(u, d) for u, d, _ in dom_cache.parsed_urls([u.strip() for u in siblings if u.strip()])
+                           if d is not None]
+
+    el = resolve_target(xpath.strip(), doc)
+    if el is None:
+        return jsonify({
+            "status": "error",
+            "reason": "no_match",
+            "message": "The XPath does not select any element on the page.",
+            "suggestion": "Send the page HTML as the browser sees it (html) if it is rendered by JavaScript.",
+        }), 400
+
+    result = generalize(el, docs)
+    tokens_used = 0
+    api_key = _get_user_api_key(data)
+    if result is None and (api_key or os.environ.get("XPATHGENIE_ALLOW_SERVER_KEY") == "1"):
+        try:
+            candidate = generalize_xpath(marked_context(el), xpath, api_key=api_key or None)
+            if candidate and xpath_cache.evaluate(doc, candidate) == [el]:
+                result = {"xpath": candidate, "kind": "llm",
+                          "holds_on": sum(1 for _, d in docs[1:] if len(xpath_cache.evaluate(d, candidate)) == 1)}
+        except Exception:
+            app.logger.exception("Generalize LLM fallback error")
+    if result is None:
+        absolute = doc.getroottree().getpath(el)
+        result = {"xpath": absolute, "kind": "absolute",
+                  "holds_on": sum(1 for _, d in docs[1:] if len(xpath_cache.evaluate(d, absolute)) == 1)}
+
+    return jsonify({
+        "status": "ok",
+        **result,
+        "sibling_pages": len(docs) - 1,
+        "sample": el.text_content().strip()[:100],
+        "elapsed_seconds": round(time.time() - t0, 3),
+    })
+
+
 @app.after_request
 def add_security_headers(response):
     response.headers['Content-Security-Policy'] = (
@@ -115,6 +261,44 @@ def add_security_headers(response):
     return response
 
 
+# Max re-analyses with the next-ranked content section when every field scores 0%
+MAX_SECTION_FALLBACKS = 2
+
+# Cascade: fields below this confidence (or empty / multi-matched) go to the next model tier
+ESCALATE_BELOW = 0.5
+
+# Consensus mode: concurrent analyze() samples per request (body "samples", capped)
+CONSENSUS_SAMPLES = int(os.environ.get("XPATHGENIE_CONSENSUS_SAMPLES", 1))
+MAX_CONSENSUS_SAMPLES = 5
+CONSENSUS_TEMPERATURE = 0.7  # samples after the first, for diverse candidates
+
+
+def _any_hit(validated: dict) -> bool:
+    """True if at least one validated field matched on at least one page."""
+    return any(v.get("confidence", 0) > 0 for v in validated.values())
+
+
+def _weak_fields(validated: dict, wantlist) -> list:
+    """Fields to escalate: requested but unmapped, low confidence, or multi-matched.
+
+    wantlist keys are compared as sanitized, the form the model answers with.
+    """
+    fields = set(validated) | set(sanitize_wantlist(wantlist or {}))
+    return sorted(
+        f for f in fields
+        if f not in validated or validated[f]["confidence"] < ESCALATE_BELOW or validated[f].get("warning")
+    )
+
+
+def _better(new: dict, old) -> bool:
+    """True if a re-validated field beats the previous one (higher hit rate, or no multi-match)."""
+    if old is None:
+        return new["confidence"] > 0
+    if new["confidence"] != old["confidence"]:
+        return new["confidence"] > old["confidence"]
+    return bool(old.get("warning")) and not new.get("warning")
+
+
 def _get_user_api_key(data):
     """Extract API key: Authorization header takes priority, POST body as fallback."""
     auth = request.headers.get("Authorization", "")
@@ -148,6 +332,40 @@ def api_analyze():
     if len(urls) > 10:
         return jsonify({"error": "Max 10 URLs"}), 400
 
+    try:
+        samples = min(max(int(data.get("samples") or CONSENSUS_SAMPLES), 1), MAX_CONSENSUS_SAMPLES)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid samples"}), 400
+    # "cache": false — no template cache, learned synonyms or refine cache (evaluation runs)
+    use_cache = data.get("cache", True) is not False
+    # "run": experiment run label — LLM cassette recordings are kept per run
+    run = data.get("run")
+    if run is not None and not isinstance(run, (str, int)):
+        return jsonify({"error": "Invalid run"}), 400
+    run = None if run is None else str(run)[:50]
+    # "jsonld": true — allow {"xpath", "jsonpath"} JSON-LD mappings (the caller applies jsonpath)
+    use_jsonld = data.get("jsonld") is True
+
+    # Optional scope from Jasmine: include selector + exclude selectors (CSS or XPath)
+    include = data.get("selector") or None
+    exclude = data.get("exclude") or []
+    if isinstance(exclude, str):
+        exclude = [exclude]
+    if (include is not None and not isinstance(include, str)) or not isinstance(exclude, list) \
+            or not all(isinstance(s, str) for s in exclude) or len(exclude) > 50:
+        return jsonify({"error": "Invalid selector/exclude"}), 400
+    try:
+        if include:
+            include = compile_selector(include)
+        exclude = [compile_selector(s) for s in exclude if s.strip()]
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "reason": "invalid_selector",
+            "message": str(e),
+            "suggestion": "Use a CSS selector (e.g. div.main > section) or an XPath starting with //.",
+        }), 400
+
     t0 = time.time()
     diagnostics = {}
 
@@ -179,43 +397,206 @@ def api_analyze():
         if html and ('\ufffd' in html[:2000] or any(ord(c) > 0xFFFD for c in html[:2000])):
             diagnostics["encoding_warning"] = "Possible encoding issues detected in fetched HTML"
 
-    # 2. Compress
-    compressed = []
+    # 2. Parse, prune and rank sections once per page (cached for fingerprinting,
+    #    label mapping and fallback)
     for p in fetched:
-        c = compress(p["html"])
-        compressed.append(c)
+        p["sections"] = prepare_sections(p["html"], include=include, exclude=exclude)
 
-    # 2b. Check compressed size
-    total_compressed = sum(len(c) for c in compressed)
-    diagnostics["compressed_size_bytes"] = total_compressed
-    if total_compressed == 0:
-        return jsonify({
-            "status": "error",
-            "reason": "compression_empty",
-            "message": "HTML compression produced empty output — the page structure could not be parsed. "
-                       "This may indicate a JavaScript-rendered SPA or an unsupported HTML structure.",
-            "suggestion": "Try a page with server-rendered HTML content.",
-            "diagnostics": diagnostics,
-        }), 422
-    if total_compressed < 100:
-        diagnostics["compression_warning"] = "Compressed HTML is very small — page may lack structured content (SPA?)"
-
-    # 3. Analyze with Gemini
+    # 2b. Template cache — a site template already mapped for this wantlist and model
+    #     is re-validated and returned without any LLM call
+    site = urlparse(urls[0]).netloc
     wantlist = data.get("wantlist")  # optional: {"field": "", ...}
-    try:
-        result = analyze(compressed, wantlist=wantlist, api_key=api_key or None)
-    except Exception as e:
-        app.logger.exception("Analyze error")
-        return jsonify({
-            "status": "error",
-            "reason": "analysis_failed",
-            "message": "AI analysis failed. Please check your API key and try again.",
-            "suggestion": "The AI could not extract field mappings. The page structure may be too complex or non-standard.",
-            "diagnostics": diagnostics,
-        }), 500
-
-    # 3b. Check if zero mappings returned
-    if not result.get("mappings"):
+    requested = wantlist if isinstance(wantlist, dict) else None
+    template = template_key(site, fingerprint(fetched[0]["sections"]), requested, ",".join(MODEL_CASCADE), use_jsonld)
+    cached = lookup(template) if use_cache else None
+    if cached:
+        cached_validated = validate(cached["mappings"], pages)
+        if still_valid(cached, cached_validated):
+            diagnostics["template_cache"] = "hit"
+            return _ok_response(site, cached_validated, pages, fetched, 0, t0, diagnostics)
+        diagnostics["template_cache"] = "stale"
+
+    # 3. Structured data fast path — wantlist fields already present as microdata or
+    #    OpenGraph (JSON-LD only with "jsonld": true) are mapped directly and never sent to Gemini
+    resolved = {}
+    synonyms = synonym_table(learned=use_cache)
+    if isinstance(wantlist, dict) and wantlist:
+        resolved = match_wantlist(fetched, wantlist, jsonld=use_jsonld)
+        if resolved:
+            diagnostics["structured_fields"] = sorted(resolved)
+            wantlist = {k: v for k, v in wantlist.items() if k not in resolved}
+    llm_needed = not resolved or bool(wantlist)
+
+    # 3b. Label/value fast path — wantlist fields whose dt/dd or th/td label is known
+    #     (built-in or learned synonyms) skip the LLM. Labels are read from the main
+    #     section and scoped to its container, as the LLM path would be
+    labeled = {}
+    if llm_needed and isinstance(wantlist, dict) and wantlist:
+        roots = [p["sections"]["candidates"][0]["el"] for p in fetched if p["sections"]]
+        labeled = match_labels(common_label_pairs(roots), wantlist, synonyms=synonyms)
+        if labeled and roots:
+            labeled = scope_to_section(labeled, roots[0], include)
+        if labeled:
+            diagnostics["label_fields"] = sorted(labeled)
+            wantlist = {k: v for k, v in wantlist.items() if k not in labeled}
+            llm_needed = bool(wantlist)
+
+    # 4. Compress
+    compressed = []
+    if llm_needed:
+        for p in fetched:
+            c = compress_section(p["sections"])
+            compressed.append(c)
+
+        # 4b. Check compressed size
+        total_compressed = sum(len(c) for c in compressed)
+        diagnostics["compressed_size_bytes"] = total_compressed
+        if total_compressed == 0:
+            return jsonify({
+                "status": "error",
+                "reason": "compression_empty",
+                "message": "HTML compression produced empty output — the page structure could not be parsed. "
+                           "This may indicate a JavaScript-rendered SPA or an unsupported HTML structure.",
+                "suggestion": "Try a page with server-rendered HTML content.",
+                "diagnostics": diagnostics,
+            }), 422
+        if total_compressed < 100:
+            diagnostics["compression_warning"] = "Compressed HTML is very small — page may lack structured content (SPA?)"
+
+        # 4c. Sample selection — structurally distinct pages within the prompt token budget
+        #     (validation still uses every fetched page)
+        sample_idx = select_samples(compressed, wantlist, synonyms=synonyms)
+        if len(sample_idx) < len(compressed):
+            diagnostics["pages_dropped"] = [fetched[i]["url"] for i in range(len(compressed)) if i not in sample_idx]
+        sampled = [fetched[i] for i in sample_idx]
+        compressed = [compressed[i] for i in sample_idx]
+
+    # 5. Analyze with Gemini (streaming and consensus modes validate each field as it arrives)
+    result = {"mappings": {}, "tokens_used": 0}
+    validated = None
+    provider = None  # one per request: shares the pool and collects retry/hedge counts
+    if llm_needed:
+        try:
+            provider = make_provider(api_key or None, run=run)
+            if samples > 1:
+                result, validated = _analyze_consensus(compressed, wantlist, provider, pages, diagnostics,
+                                                       samples, model=MODEL_CASCADE[0], synonyms=synonyms)
+            elif USE_STREAMING:
+                result, validated = _analyze_streaming(compressed, wantlist, provider, pages, diagnostics,
+                                                       model=MODEL_CASCADE[0], synonyms=synonyms)
+            else:
+                result = analyze(compressed, wantlist=wantlist, provider=provider, model=MODEL_CASCADE[0],
+                                 synonyms=synonyms)
+        except CircuitOpenError:
+            diagnostics["llm"] = provider.stats.as_dict()
+            return jsonify({
+                "status": "error",
+                "reason": "llm_unavailable",
+                "message": "The AI service is failing repeatedly; requests are paused briefly.",
+                "suggestion": "Try again in about 30 seconds.",
+                "diagnostics": diagnostics,
+            }), 503
+        except Exception as e:
+            app.logger.exception("Analyze error")
+            return jsonify({
+                "status": "error",
+                "reason": "analysis_failed",
+                "message": "AI analysis failed. Please check your API key and try again.",
+                "suggestion": "The AI could not extract field mappings. The page structure may be too complex or non-standard.",
+                "diagnostics": diagnostics,
+            }), 500
+
+    if result.get("shards"):
+        diagnostics["analyze_shards"] = result["shards"]
+    if result.get("shards_failed"):
+        diagnostics["analyze_shards_failed"] = result["shards_failed"]
+    if result.get("continuations"):
+        diagnostics["truncation_continuations"] = result["continuations"]
+    if result.get("chunks"):
+        diagnostics["analyze_chunks"] = result["chunks"]
+    if result.get("chunks_dropped"):
+        diagnostics["analyze_chunks_dropped"] = result["chunks_dropped"]
+
+    # 6. Validate (already done per field in streaming mode)
+    if validated is None:
+        validated = validate(result["mappings"], pages) if result.get("mappings") else {}
+
+    # 6b. Adaptive section fallback — every field at 0%: re-compress the next-ranked
+    #     cached section and re-run only the LLM (no re-fetch, re-parse or re-rank).
+    #     Fields already mapped by labels or structured data show the section is right
+    section_index = 0
+    fallbacks = []
+    section_confirmed = bool(labeled or resolved)
+    while llm_needed and not section_confirmed and not _any_hit(validated) \
+            and section_index < MAX_SECTION_FALLBACKS:
+        section_index += 1
+        retry_compressed = [compress_section(p["sections"], section_index) for p in sampled]
+        retry_compressed = [c for c in retry_compressed if c]
+        if not retry_compressed:
+            break
+        try:
+            retry = analyze(retry_compressed, wantlist=wantlist, provider=provider, model=MODEL_CASCADE[0],
+                            synonyms=synonyms)
+        except Exception:
+            app.logger.exception("Fallback analyze error")
+            break
+        retry_validated = validate(retry["mappings"], pages) if retry.get("mappings") else {}
+        result["tokens_used"] = result.get("tokens_used", 0) + retry.get("tokens_used", 0)
+        first_candidates = (fetched[0]["sections"] or {}).get("candidates", [])
+        fallbacks.append({
+            "section": section_index,
+            "section_id": first_candidates[section_index]["id"] if section_index < len(first_candidates) else None,
+            "fields_hit": sum(1 for v in retry_validated.values() if v["confidence"] > 0),
+        })
+        if _any_hit(retry_validated):
+            retry["tokens_used"] = result["tokens_used"]
+            result, validated = retry, retry_validated
+            compressed = retry_compressed
+    if fallbacks:
+        diagnostics["section_fallback"] = fallbacks
+
+    # 6c. Model cascade — fields the cheaper tier left empty, below ESCALATE_BELOW or
+    #     multi-matched are re-asked of the next tier; the better validation wins
+    tiers = {f: MODEL_CASCADE[0] for f in result.get("mappings", {})}
+    escalations = []
+    wanted = sanitize_wantlist(wantlist or {})
+    for model in MODEL_CASCADE[1:] if llm_needed else []:
+        weak = _weak_fields(validated, wantlist)
+        if not weak:
+            break
+        try:
+            stronger = analyze(compressed, wantlist={f: wanted.get(f, "") for f in weak},
+                               provider=provider, model=model, synonyms=synonyms)
+        except Exception:
+            app.logger.exception("Escalation analyze error")
+            break
+        for k in TOKEN_COUNTS:
+            result[k] = result.get(k, 0) + stronger.get(k, 0)
+        stronger_validated = validate(stronger["mappings"], pages) if stronger.get("mappings") else {}
+        improved = []
+        for f, entry in stronger_validated.items():
+            if f in weak and _better(entry, validated.get(f)):
+                validated[f] = entry
+                result["mappings"][f] = stronger["mappings"][f]
+                tiers[f] = model
+                improved.append(f)
+        escalations.append({"model": model, "fields": weak, "improved": sorted(improved)})
+    if escalations:
+        diagnostics["escalations"] = escalations
+    if llm_needed:
+        diagnostics["prompt_tokens"] = {
+            "estimated": result.get("prompt_tokens_estimated", 0),
+            "actual": result.get("prompt_tokens", 0),
+            "cached": result.get("cached_tokens", 0),
+        }
+
+    # 6d. Merge rule-based label mappings (refined together with the LLM output)
+    if labeled:
+        validated = {**validate(labeled, pages), **validated}
+        result["mappings"] = {**labeled, **result["mappings"]}
+
+    # 6e. Check if zero mappings returned
+    if not result.get("mappings") and not resolved:
         return jsonify({
             "status": "error",
             "reason": "no_fields_detected",
@@ -224,47 +605,167 @@ def api_analyze():
             "diagnostics": diagnostics,
         }), 200
 
-    # 4. Validate
-    validated = validate(result["mappings"], pages)
-
-    # 5. Refine — multi-match fields
+    # 7. Refine — multi-match fields
     refined_fields = []
-    multi = find_multi_matches(result["mappings"], pages)
+    multi = find_multi_matches(result["mappings"], pages) if result.get("mappings") else {}
     if multi:
         updated_mappings = dict(result["mappings"])
 
-        # 5a. Identical values — mechanical narrowing (add intermediate class path)
+        # 7a. Identical values — mechanical narrowing (add intermediate class path)
         narrowed = narrow_by_first_match(result["mappings"], multi, pages)
         if narrowed:
             updated_mappings.update(narrowed)
             refined_fields.extend(narrowed.keys())
 
-        # 5b. Different values — AI refine
+        # 7b. Different values — AI refine
         ai_targets = {k: v for k, v in multi.items() if not v.get("all_identical") and k not in narrowed}
+        ai_refined, refine_models = {}, {}
         if ai_targets:
             try:
-                ai_refined = refine(ai_targets, api_key=api_key or None)
+                provider = provider or make_provider(api_key or None, run=run)
+                ai_refined = refine(ai_targets, provider=provider, use_cache=use_cache, models=refine_models)
                 if ai_refined:
                     updated_mappings.update(ai_refined)
                     refined_fields.extend(ai_refined.keys())
+                    tiers.update(refine_models)
             except Exception:
                 pass
 
         if refined_fields:
+            before = validated
             validated = validate(updated_mappings, pages)
 
-    # Build response
-    site = urlparse(urls[0]).netloc
-    elapsed = round(time.time() - t0, 1)
-
+            # 7c. Keep AI refinements in the refine cache only if they came out unique
+            #     without losing confidence; forget cached ones that no longer do
+            if ai_refined and use_cache:
+                good, bad = {}, []
+                for f, xpath in ai_refined.items():
+                    key = refine_cache.refine_key(f, ai_targets[f])
+                    entry = validated.get(f, {})
+                    if "warning" not in entry and entry.get("confidence", 0) >= before.get(f, {}).get("confidence", 0):
+                        good[key] = {"xpath": xpath, "model": refine_models.get(f, MODEL)}
+                    else:
+                        bad.append(key)
+                refine_cache.store(good)
+                refine_cache.forget(bad)
+
+    # 7d. Merge structured-data fields resolved without the LLM
+    if resolved:
+        validated = {**validate(resolved, pages), **validated}
+
+    # Model tier that produced each LLM field
+    for f, entry in validated.items():
+        if f in tiers:
+            entry["model"] = tiers[f]
+
+    if provider and provider.stats.as_dict():
+        diagnostics["llm"] = provider.stats.as_dict()
+
+    # 7e. Learn field → label synonyms from fully validated Want List mappings
+    #     (used only once seen on several distinct sites)
+    if requested and use_cache:
+        learn(requested, validated, site)
+
+    # 7f. Remember the mappings for this site template
+    if use_cache:
+        store_template(template, validated)
+
+    return _ok_response(site, validated, pages, fetched, result.get("tokens_used", 0), t0,
+                        diagnostics, refined_fields)
+
+
+def _analyze_streaming(compressed, wantlist, provider, pages, diagnostics, model=None, synonyms=None):
+    """analyze_stream() with per-field validation overlapped with generation.
+
+    Returns (result, validated). Fields whose final XPath differs from the
+    streamed one (e.g. a repeated key) are re-validated after the stream ends.
+    """
+    docs = parse_pages(pages)
+    containers = {}
+    early = {}
+    t_start = time.time()
+    first_field = []
+
+    def on_field(field, xpath):
+        if not first_field:
+            first_field.append(time.time() - t_start)
+        early[field] = (xpath, validate_field(xpath, docs, containers) if docs else None)
+
+    result = analyze_stream(compressed, wantlist=wantlist, provider=provider, on_field=on_field, model=model,
+                            synonyms=synonyms)
+    validated = {}
+    if docs:
+        for field, xpath in result.get("mappings", {}).items():
+            streamed_xpath, entry = early.get(field, (None, None))
+            validated[field] = entry if streamed_xpath == xpath else validate_field(xpath, docs, containers)
+    diagnostics["stream"] = {
+        "first_field_seconds": round(first_field[0], 2) if first_field else None,
+        "fields_validated_early": sum(1 for f, (x, _) in early.items() if result["mappings"].get(f) == x),
+    }
+    return result, validated
+
+
+def _analyze_consensus(compressed, wantlist, provider, pages, diagnostics, samples, model=None, synonyms=None):
+    """Concurrent analyze() samples, validated as each one arrives.
+
+    Returns (result, validated) like _analyze_streaming(): per field the best
+    validated XPath over the samples received. Stops as soon as every field
+    (every Want List field, in discover mode every field seen) has a
+    confidence 1.0 XPath; queued samples are cancelled and calls still in
+    flight are abandoned — their output is ignored.
+    """
+    docs = parse_pages(pages)
+    containers = {}
+    executor = ThreadPoolExecutor(max_workers=samples)
+    futures = [
+        executor.submit(analyze, compressed, wantlist=wantlist, provider=cassette.for_sample(provider, i),
+                        model=model, temperature=None if i == 0 else CONSENSUS_TEMPERATURE, synonyms=synonyms)
+        for i in range(samples)
+    ]
+    result = {"mappings": {}, **{k: 0 for k in TOKEN_COUNTS}}
+    validated = {}
+    completed, errors = 0, []
+    try:
+        for future in as_completed(futures):
+            try:
+                sample = future.result()
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                errors.append(e)
+                continue
+            completed += 1
+            for k in TOKEN_COUNTS:
+                result[k] += sample.get(k, 0)
+            for k in ("container", "truncated", "continuations", "shards", "shards_failed", "chunks", "chunks_dropped"):
+                if sample.get(k) and k not in result:
+                    result[k] = sample[k]
+            for field, xpath in sample["mappings"].items():
+                entry = validate_field(xpath, docs, containers) if docs else {"confidence": 0}
+                if field not in validated or _better(entry, validated[field]):
+                    validated[field] = entry
+                    result["mappings"][field] = xpath
+            targets = list(sanitize_wantlist(wantlist)) if wantlist else list(validated)
+            if targets and all(validated.get(f, {}).get("confidence") == 1.0 for f in targets):
+                break
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    if not completed:
+        raise errors[0]
+    diagnostics["consensus"] = {"samples": samples, "completed": completed, "failed": len(errors),
+                                "stopped_early": completed + len(errors) < samples}
+    return result, (validated if docs else {})
+
+
+def _ok_response(site, validated, pages, fetched, tokens_used, t0, diagnostics, refined_fields=None):
     resp_data = {
         "status": "ok",
         "site": site,
         "mappings": validated,
         "pages_analyzed": len(fetched),
         "pages_failed": len(pages) - len(fetched),
-        "tokens_used": result.get("tokens_used", 0),
-        "elapsed_seconds": elapsed,
+        "tokens_used": tokens_used,
+        "elapsed_seconds": round(time.time() - t0, 1),
     }
     if refined_fields:
         resp_data["refined_fields"] = refined_fields
@@ -1,8 +1,15 @@
 """Gemini 2.5 Flash API call for XPath mapping generation."""
 
+import hashlib
 import json
 import os
-import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from genie import cassette, chunking, context_cache, metrics, refine_cache, retrieval
+from genie.jsonstream import MappingStreamParser
+from genie.llm import CircuitOpenError, get_provider, http_status
+from genie.sampling import estimate_tokens, select_pages
+from genie.validator import parse_pages, validate_field
 
 API_KEY_PATHS = [
     os.path.expanduser("~/.config/gemini/api_key"),
@@ -11,6 +18,30 @@ API_KEY_PATHS = [
 
 MODEL = "gemini-2.5-flash"
 
+# Cheapest model first; fields it gets wrong are escalated to the next tier.
+# Off by default ([MODEL] only); opt in with e.g. "gemini-2.5-flash-lite,gemini-2.5-flash".
+MODEL_CASCADE = [m.strip() for m in os.environ.get(
+    "XPATHGENIE_MODEL_CASCADE", MODEL).split(",") if m.strip()] or [MODEL]
+PAGE_CHARS = 8000  # compressed HTML per page sent to the model
+# Pages longer than PAGE_CHARS are split into chunks analyzed concurrently ("0" truncates instead)
+CHUNK_PAGES = os.environ.get("XPATHGENIE_CHUNK_PAGES", "1") != "0"
+
+# Want lists larger than SHARD_THRESHOLD are split into topic-grouped shards of
+# at most MAX_SHARD_FIELDS, analyzed concurrently over the same pages
+SHARD_THRESHOLD = 12
+MAX_SHARD_FIELDS = 10
+
+# Topic keywords (matched in field names and descriptions) that keep related fields in one shard
+SHARD_TOPICS = [
+    ("location", ("access", "address", "area", "city", "line", "prefecture", "station", "location",
+                  "住所", "最寄", "駅", "路線", "勤務地", "アクセス")),
+    ("pay", ("price", "salary", "wage", "bonus", "pay", "給与", "賞与", "手当", "昇給")),
+    ("schedule", ("hour", "holiday", "shift", "style", "period", "time", "勤務時間", "休日", "休暇", "期間")),
+    ("requirement", ("license", "skill", "qualification", "experience", "資格", "スキル", "経験")),
+    ("organization", ("facility", "company", "dept", "occupation", "position", "contract", "job",
+                      "施設", "会社", "部署", "職種", "役職", "雇用")),
+]
+
 
 def _get_api_key() -> str:
     for p in API_KEY_PATHS:
@@ -19,6 +50,14 @@ def _get_api_key() -> str:
     raise RuntimeError("Gemini API key not found")
 
 
+def make_provider(api_key: str = None, run: str = None):
+    """LLM provider for a user key, falling back to the server key (wrapped by a cassette if configured).
+
+    run labels an experiment run; cassette recordings are kept per run.
+    """
+    return cassette.wrap(lambda: get_provider(api_key or _get_api_key()), salt=run)
+
+
 PROMPT_DISCOVER = """You are an expert web scraper. Analyze the following compressed HTML samples from the same website.
 Identify all meaningful data fields that can be extracted, and provide XPath expressions that work across all pages.
 
@@ -37,6 +76,7 @@ Rules:
 - Output SIMPLE XPaths with NO container prefix (the system adds scoping automatically)
 - Example: //dt[normalize-space()='給与']/following-sibling::dd[1] (correct)
 - Example: //div[contains(@class,'xxx')]//dt[...] (WRONG — do not add container)
+- A page may be given as excerpts, each after an <!-- /ancestor/path --> comment; XPaths must still work on the full page
 - Return valid JSON only, no markdown, no explanation
 
 HTML samples:
@@ -62,6 +102,7 @@ Rules:
 - Output SIMPLE XPaths with NO container prefix (the system adds scoping automatically)
 - Example: //dt[normalize-space()='給与']/following-sibling::dd[1] (correct)
 - Example: //div[contains(@class,'xxx')]//dt[...] (WRONG — do not add container)
+- A page may be given as excerpts, each after an <!-- /ancestor/path --> comment; XPaths must still work on the full page
 - Return valid JSON only, no markdown, no explanation
 
 HTML samples:
@@ -69,14 +110,27 @@ HTML samples:
 
 
 def _parse_response(data: dict) -> dict:
-    """Parse Gemini response, extract mappings and token count."""
+    """Parse Gemini response, extract mappings and token count.
+
+    "truncated" is set when the output hit maxOutputTokens (finishReason) or
+    had to be cut back to its last complete entry; "keys" lists every field
+    the model returned, including nulls, so callers can request the rest.
+    """
     try:
-        text = data["candidates"][0]["content"]["parts"][0]["text"]
-    except (KeyError, IndexError):
+        candidate = data["candidates"][0]
+        finish_reason = candidate.get("finishReason")
+        parts = candidate.get("content", {}).get("parts")
+        if not parts and finish_reason == "MAX_TOKENS":
+            parts = [{"text": ""}]  # cut off before any text
+        text = parts[0]["text"]
+    except (KeyError, IndexError, TypeError):
         raise RuntimeError(f"Unexpected Gemini response: {json.dumps(data)[:500]}")
+    truncated = finish_reason == "MAX_TOKENS"
+    repaired = False
 
     text = text.strip()
     if text.startswith("```"):
+        repaired = True
         text = text.split("\n", 1)[1] if "\n" in text else text[3:]
         if text.endswith("```"):
             text = text[:-3]
@@ -85,34 +139,97 @@ def _parse_response(data: dict) -> dict:
     try:
         mappings = json.loads(text)
     except json.JSONDecodeError:
+        repaired = True
         start = text.find('{')
         end = text.rfind('}')
+        mappings = None
         if start >= 0 and end > start:
             try:
                 mappings = json.loads(text[start:end+1])
             except json.JSONDecodeError:
-                truncated = text[start:]
-                last_comma = truncated.rfind('",')
-                if last_comma > 0:
-                    truncated = truncated[:last_comma+1] + "}"
-                    try:
-                        mappings = json.loads(truncated)
-                    except json.JSONDecodeError:
-                        raise RuntimeError(f"Failed to parse Gemini response as JSON: {text[:500]}")
-                else:
-                    raise RuntimeError(f"Failed to parse Gemini response as JSON: {text[:500]}")
-        else:
+                pass
+        if mappings is None and start >= 0:
+            # Cut off mid-object — keep the complete entries, the rest is re-requested
+            truncated = True
+            last_comma = text.rfind('",')
+            if last_comma > start:
+                try:
+                    mappings = json.loads(text[start:last_comma+1] + "}")
+                except json.JSONDecodeError:
+                    pass
+        if mappings is None and finish_reason == "MAX_TOKENS":
+            # Cut off before the first complete entry (or before any text, e.g. when
+            # thinking used up maxOutputTokens) — everything is re-requested
+            mappings = {}
+        if mappings is None:
+            metrics.incr("parse_failures")
             raise RuntimeError(f"Failed to parse Gemini response as JSON: {text[:500]}")
+    metrics.incr("parse_repaired" if repaired else "parse_ok")
 
+    keys = list(mappings)
     # Remove null mappings
     mappings = {k: v for k, v in mappings.items() if v is not None}
 
-    tokens_used = data.get("usageMetadata", {}).get("totalTokenCount", 0)
-    return {"mappings": mappings, "tokens_used": tokens_used}
+    usage = data.get("usageMetadata", {})
+    return {"mappings": mappings, "tokens_used": usage.get("totalTokenCount", 0),
+            "prompt_tokens": usage.get("promptTokenCount", 0),
+            "cached_tokens": usage.get("cachedContentTokenCount", 0), "truncated": truncated, "keys": keys}
+
+
+# Token counts summed across shards, follow-ups and escalations
+TOKEN_COUNTS = ("tokens_used", "prompt_tokens", "prompt_tokens_estimated", "cached_tokens")
+
+
+PARSE_RETRIES = 1  # re-issue a call whose output could not be parsed at all
+
+
+def response_schema(fields) -> dict:
+    """responseSchema for a {field: xpath-or-null} object with exactly these fields."""
+    fields = list(fields)
+    return {
+        "type": "OBJECT",
+        "properties": {f: {"type": "STRING", "nullable": True} for f in fields},
+        "required": fields,
+        "propertyOrdering": fields,
+    }
+
+
+def _cache_rejected(e: Exception) -> bool:
+    """The provider refused a cachedContent handle (expired, deleted or model mismatch)."""
+    return http_status(e) in (400, 403, 404)
+
+
+def _generate(provider, content: str, config: dict, model: str, prefix: str = None, cache_tag: str = None) -> dict:
+    """provider.generate(), sending only the part after prefix when prefix is context-cached."""
+    cached = context_cache.cached_prefix(provider, model, cache_tag, prefix) if prefix else None
+    if cached and content.startswith(prefix):
+        try:
+            return provider.generate(content[len(prefix):], model, config, cached_content=cached)
+        except Exception as e:
+            if not _cache_rejected(e):
+                raise
+            context_cache.forget(provider, model, cache_tag, prefix)
+    return provider.generate(content, model, config)
+
+
+def _generate_parsed(provider, content: str, config: dict, model: str = MODEL,
+                     prefix: str = None, cache_tag: str = None) -> dict:
+    """provider.generate() + _parse_response(), retrying unparseable output."""
+    if "responseSchema" in config:
+        metrics.incr("schema_calls")
+    for attempt in range(PARSE_RETRIES + 1):
+        metrics.incr("llm_calls")
+        data = _generate(provider, content, config, model, prefix, cache_tag)
+        try:
+            return {**_parse_response(data), "prompt_tokens_estimated": estimate_tokens(content)}
+        except RuntimeError:
+            if attempt == PARSE_RETRIES:
+                raise
+            metrics.incr("parse_retries")
 
 
 PROMPT_REFINE = """You are an expert web scraper. Some XPath expressions matched MULTIPLE nodes on the same page.
-For each field, examine the surrounding HTML context of the multiple matches, determine which match is the PRIMARY/most important one (the main job detail, not sidebar/recommendations/summary), and return a MORE SPECIFIC XPath that matches only that one.
+For each field, examine the surrounding HTML context of the multiple matches on every sample page, determine which match is the PRIMARY/most important one (the main job detail, not sidebar/recommendations/summary), and return a MORE SPECIFIC XPath that matches only that one.
 
 Strategy:
 - Look for intermediate structural containers (divs with meaningful class names) between the page-level container and the target dt/dd
@@ -121,24 +238,82 @@ Strategy:
 - Pick the match that contains the MOST DETAILED information (full description > summary)
 - Keep XPaths as simple as possible while being unique
 
-Fields that need refinement:
-{fields_json}
-
 Rules:
 - Return ONLY a JSON object: {{"field_name": "refined_xpath", ...}}
-- Include ONLY the fields listed above (the ones that need fixing)
+- Include ONLY the fields listed below (the ones that need fixing)
+- The refined XPath must select the primary match on EVERY page shown, not just the first
 - XPaths must start with // and use contains(@class,...) for class matching
 - Do NOT use functions like substring-after or normalize-space
 - Return valid JSON only, no markdown, no explanation
+
+Fields that need refinement:
+{fields_json}
+"""
+
+# Fixed instruction blocks; the version is part of every context-cache key
+PROMPT_VERSION = hashlib.sha1((PROMPT_DISCOVER + PROMPT_WANTLIST + PROMPT_REFINE).encode("utf-8")).hexdigest()[:8]
+
+
+PROMPT_GENERALIZE = """You are an expert web scraper. A user clicked the element marked data-xpg-target="1" in the HTML below. Its absolute XPath is: {xpath}
+Return a SHORT, robust XPath that selects exactly this element and would still work on other pages built from the same template.
+
+Rules:
+- Prefer label anchors (//dt[normalize-space()='ラベル']/following-sibling::dd[1], //th[normalize-space()='ラベル']/following-sibling::td[1]) or class/id anchors with contains(@class,...)
+- Keep positional steps to a minimum and never reference the data-xpg-target attribute
+- Return ONLY a JSON object: {{"xpath": "..."}}
+
+HTML around the element:
+{html}
 """
 
 
-def refine(multi_matches: dict, api_key: str = None) -> dict:
+def generalize_xpath(context_html: str, xpath: str, api_key: str = None, provider=None):
+    """Ask the model for an anchored XPath for a clicked element (fallback for synthesis.generalize())."""
+    if provider is None:
+        provider = make_provider(api_key)
+    content = PROMPT_GENERALIZE.format(xpath=xpath, html=context_html[:PAGE_CHARS])
+    result = _generate_parsed(provider, content, {
+        "temperature": 0.1,
+        "maxOutputTokens": 1024,
+        "responseMimeType": "application/json",
+        "responseSchema": response_schema(["xpath"]),
+    })
+    return result["mappings"].get("xpath")
+
+
+REFINE_GROUP_SIZE = 2  # fields per concurrent refine call
+REFINE_MAX_PAGES = 5  # pages of context per field
+REFINE_SNIPPETS_PER_PAGE = 2
+
+
+def _refine_group(fields_info: dict, provider) -> dict:
+    content = PROMPT_REFINE.format(fields_json=json.dumps(fields_info, ensure_ascii=False, indent=2))
+    prefix = PROMPT_REFINE.split("{fields_json}")[0].format()
+    result = _generate_parsed(provider, content, {
+        "temperature": 0.1,
+        "maxOutputTokens": 4096,
+        "responseMimeType": "application/json",
+        "responseSchema": response_schema(fields_info),
+    }, prefix=prefix, cache_tag=f"refine:{PROMPT_VERSION}")
+    return result.get("mappings", {})
+
+
+def refine(multi_matches: dict, api_key: str = None, provider=None, use_cache: bool = True,
+           models: dict = None) -> dict:
     """
     Call Gemini to refine XPaths that have multiple matches.
+
+    Each field gets match contexts from up to REFINE_MAX_PAGES pages; fields
+    are refined REFINE_GROUP_SIZE at a time in concurrent calls. Refinements
+    cached by (field, xpath, context structure) are reused; callers store new
+    ones only once they validate — see genie.refine_cache.
     
     Args:
         multi_matches: {field: {xpath, contexts: [{url, count, snippets}]}}
+        provider: LLMProvider to use (default: get_provider(api_key))
+        use_cache: False to skip genie.refine_cache lookups
+        models: if given, filled with {field: model that produced the XPath}
+            (for cache hits, the model recorded with the cached refinement)
     
     Returns:
         {field: refined_xpath} for successfully refined fields
@@ -146,36 +321,55 @@ def refine(multi_matches: dict, api_key: str = None) -> dict:
     if not multi_matches:
         return {}
 
-    if not api_key:
-        api_key = _get_api_key()
+    refined = {}
+    keys = {}
+    for field, info in multi_matches.items():
+        key = refine_cache.refine_key(field, info)
+        cached = refine_cache.lookup(key) if use_cache else None
+        if cached:
+            refined[field] = cached["xpath"]
+            if models is not None:
+                models[field] = cached.get("model", MODEL)
+            metrics.incr("refine_cache_hits")
+        else:
+            keys[field] = key
+    if not keys:
+        return refined
+
+    if provider is None:
+        provider = make_provider(api_key)
 
-    # Build context for the AI
+    # Build context for the AI: the matches on every page, not just the first
     fields_info = {}
-    for field, info in multi_matches.items():
-        ctx = info["contexts"][0]  # Use first page's context
+    for field in keys:
+        info = multi_matches[field]
         fields_info[field] = {
             "current_xpath": info["xpath"],
-            "match_count": ctx["count"],
-            "surrounding_html": ctx["snippets"],
-        }
-
-    content = PROMPT_REFINE.format(fields_json=json.dumps(fields_info, ensure_ascii=False, indent=2))
-
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL}:generateContent?key={api_key}"
-    payload = {
-        "contents": [{"parts": [{"text": content}]}],
-        "generationConfig": {
-            "temperature": 0.1,
-            "maxOutputTokens": 4096,
-            "responseMimeType": "application/json",
+            "pages": [
+                {"match_count": ctx["count"], "surrounding_html": ctx["snippets"][:REFINE_SNIPPETS_PER_PAGE]}
+                for ctx in info["contexts"][:REFINE_MAX_PAGES]
+            ],
         }
-    }
 
-    resp = requests.post(url, json=payload, timeout=120)
-    resp.raise_for_status()
+    fields = list(fields_info)
+    groups = [{f: fields_info[f] for f in fields[i:i + REFINE_GROUP_SIZE]}
+              for i in range(0, len(fields), REFINE_GROUP_SIZE)]
+    with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+        futures = [executor.submit(_refine_group, group, provider) for group in groups]
+        results = []
+        for f in futures:
+            try:
+                results.append(f.result())
+            except Exception:
+                continue  # other groups still count; unrefined fields keep their XPath
 
-    result = _parse_response(resp.json())
-    return result.get("mappings", {})
+    for mappings in results:
+        for field, xpath in mappings.items():
+            if field in keys and xpath and xpath != multi_matches[field]["xpath"]:
+                refined[field] = xpath
+                if models is not None:
+                    models[field] = MODEL
+    return refined
 
 
 def _detect_root_prefix(compressed_html: str) -> str:
@@ -183,16 +377,27 @@ def _detect_root_prefix(compressed_html: str) -> str:
     import re
     # Match the first opening tag with class
     m = re.match(r'<(\w+)\s+class="([^"]+)"', compressed_html.strip())
-    if m:
-        tag, classes = m.group(1), m.group(2)
-        # Use the first meaningful class name
-        cls_list = classes.split()
-        for cls in cls_list:
-            if len(cls) > 2 and cls not in ('l-centering', 'is-bg', 'wow', 'fadeInUp'):
-                return f"//{tag}[contains(@class,'{cls}')]"
+    return _class_prefix(m.group(1), m.group(2)) if m else ""
+
+
+def _class_prefix(tag: str, classes: str) -> str:
+    # Use the first meaningful class name
+    for cls in (classes or "").split():
+        if len(cls) > 2 and cls not in ('l-centering', 'is-bg', 'wow', 'fadeInUp'):
+            return f"//{tag}[contains(@class,'{cls}')]"
     return ""
 
 
+def scope_to_section(mappings: dict, section_el, include=None) -> dict:
+    """Prefix rule-based mappings (e.g. label paths) like analyze() prefixes LLM output.
+
+    The prefix is the include selector's XPath when one was given, otherwise
+    the container analyze() would detect for the compressed section_el.
+    """
+    prefix = include.path if include is not None else _class_prefix(section_el.tag, section_el.get("class"))
+    return _add_prefix(mappings, prefix)
+
+
 def _add_prefix(mappings: dict, prefix: str) -> dict:
     """Ensure all XPaths are scoped under the container with // (descendant)."""
     if not prefix:
@@ -224,8 +429,12 @@ def _add_prefix(mappings: dict, prefix: str) -> dict:
     return result
 
 
-def _sanitize_wantlist(wantlist: dict) -> dict:
-    """Sanitize wantlist values to prevent prompt injection."""
+def sanitize_wantlist(wantlist: dict) -> dict:
+    """Sanitize wantlist values to prevent prompt injection.
+
+    Keys are reduced to alphanumerics and "_" ("job-title" → "jobtitle"); the
+    model answers with these keys, so compare results against them.
+    """
     sanitized = {}
     for k, v in wantlist.items():
         # Keys: only allow alphanumeric + underscore
@@ -237,38 +446,262 @@ def _sanitize_wantlist(wantlist: dict) -> dict:
     return sanitized
 
 
-def analyze(compressed_htmls: list, wantlist: dict = None, api_key: str = None) -> dict:
+def _prompt_prefix(wantlist: dict = None) -> tuple:
+    """Fixed start of the analyze prompt and its context-cache tag (prompt version + want-list hash)."""
+    if wantlist:
+        wl = json.dumps(sanitize_wantlist(wantlist), ensure_ascii=False, indent=2)
+        wl_hash = hashlib.sha1(wl.encode("utf-8")).hexdigest()[:12]
+        return PROMPT_WANTLIST.format(wantlist=wl), f"wantlist:{PROMPT_VERSION}:{wl_hash}"
+    return PROMPT_DISCOVER, f"discover:{PROMPT_VERSION}"
+
+
+def _page_text(html: str, wantlist: dict = None, synonyms: dict = None) -> str:
+    """A page as sent to the model: Want List mode sends only the relevant regions (see genie.retrieval)."""
+    scoped = retrieval.scope_page(html, sanitize_wantlist(wantlist), PAGE_CHARS, synonyms) if wantlist else None
+    return scoped if scoped is not None else html[:PAGE_CHARS]
+
+
+def _build_prompt(compressed_htmls: list, wantlist: dict = None, synonyms: dict = None) -> str:
+    content, _ = _prompt_prefix(wantlist)
+
+    for i, html in enumerate(compressed_htmls):
+        content += f"\n--- Page {i+1} ---\n{_page_text(html, wantlist, synonyms)}\n"
+    return content
+
+
+def select_samples(compressed_htmls: list, wantlist: dict = None, budget: int = None, synonyms: dict = None) -> list:
+    """Indices of the compressed pages worth sending, within the prompt token budget."""
+    base_tokens = estimate_tokens(_build_prompt([], wantlist))
+    return select_pages([_page_text(html, wantlist, synonyms) for html in compressed_htmls], base_tokens, budget)
+
+
+ANALYZE_CONFIG = {
+    "temperature": 0.1,
+    "maxOutputTokens": 8192,
+    "responseMimeType": "application/json",
+}
+
+
+def _analyze_config(wantlist: dict = None, temperature: float = None) -> dict:
+    """ANALYZE_CONFIG, constrained to the Want List's keys when one is given.
+
+    Discover mode has no fixed field set, so it keeps plain JSON mode.
+    temperature overrides the default (e.g. for diverse consensus samples).
+    """
+    config = ANALYZE_CONFIG if temperature is None else {**ANALYZE_CONFIG, "temperature": temperature}
+    if not wantlist:
+        return config
+    return {**config, "responseSchema": response_schema(sanitize_wantlist(wantlist))}
+
+
+MAX_CONTINUATIONS = 2
+
+PROMPT_CONTINUE = """
+Your previous answer was cut off at the output limit. These fields were already returned — do NOT repeat them:
+{done}
+Return ONLY a JSON object with the remaining fields.
+"""
+
+
+def _complete_truncated(result: dict, compressed_htmls: list, wantlist: dict, provider, model: str = MODEL,
+                        synonyms: dict = None) -> dict:
+    """Recover fields lost to output truncation with follow-up requests.
+
+    Want List mode asks again for only the missing fields; discover mode
+    asks for the fields not yet returned. Finished output is never regenerated.
+    """
+    wanted = sanitize_wantlist(wantlist) if wantlist else None
+    continuations = 0
+    while result.get("truncated") and continuations < MAX_CONTINUATIONS:
+        if wanted:
+            missing = {k: v for k, v in wanted.items() if k not in result["keys"]}
+            if not missing:
+                break
+            content = _build_prompt(compressed_htmls, missing, synonyms)
+        else:
+            content = _build_prompt(compressed_htmls) + PROMPT_CONTINUE.format(
+                done=json.dumps(result["keys"], ensure_ascii=False))
+        continuations += 1
+        prefix, tag = _prompt_prefix(missing if wanted else None)
+        more = _generate_parsed(provider, content, _analyze_config(missing if wanted else None), model,
+                                prefix, tag)
+        new_keys = [k for k in more["keys"] if k not in result["keys"]]
+        result["mappings"].update({k: v for k, v in more["mappings"].items() if k in new_keys})
+        result["keys"] += new_keys
+        for k in TOKEN_COUNTS:
+            result[k] += more[k]
+        result["truncated"] = more["truncated"] and bool(new_keys)
+    if continuations:
+        result["continuations"] = continuations
+    return result
+
+
+def _field_topic(field: str, description) -> str:
+    text = f"{field} {description or ''}".lower()
+    for topic, keywords in SHARD_TOPICS:
+        if any(k in text for k in keywords):
+            return topic
+    return field.split("_")[0]
+
+
+def shard_wantlist(wantlist: dict) -> list:
+    """Split a large want list into topic-grouped shards (small lists stay whole)."""
+    if not wantlist or len(wantlist) <= SHARD_THRESHOLD:
+        return [wantlist]
+    groups = {}
+    for field, desc in wantlist.items():
+        groups.setdefault(_field_topic(field, desc), []).append(field)
+
+    n_shards = -(-len(wantlist) // MAX_SHARD_FIELDS)
+    shards = [[] for _ in range(n_shards)]
+    # Largest groups first, each into the emptiest shard; oversized groups are split
+    for fields in sorted(groups.values(), key=len, reverse=True):
+        while fields:
+            target = min(shards, key=len)
+            room = MAX_SHARD_FIELDS - len(target)
+            if room <= 0:
+                shards.append([])
+                continue
+            target.extend(fields[:room])
+            fields = fields[room:]
+    return [{f: wantlist[f] for f in shard} for shard in shards if shard]
+
+
+def _analyze_sharded(fn, shards: list, compressed_htmls: list, provider, **kwargs) -> dict:
+    """Run fn (analyze / analyze_stream) per shard concurrently and merge the results.
+
+    A failing shard does not discard the others: its fields are listed under
+    "shards_failed" (one field list per shard). Only an open circuit, or every
+    shard failing, raises.
+    """
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [executor.submit(fn, compressed_htmls, wantlist=shard, provider=provider, **kwargs)
+                   for shard in shards]
+        results, failed, errors = [], [], []
+        for shard, future in zip(shards, futures):
+            try:
+                results.append(future.result())
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                failed.append(sorted(shard))
+                errors.append(e)
+    if not results:
+        raise errors[0]
+    merged = {"mappings": {}, "shards": len(shards), **{k: 0 for k in TOKEN_COUNTS}}
+    if failed:
+        merged["shards_failed"] = failed
+    for r in results:
+        merged["mappings"].update(r["mappings"])
+        for k in TOKEN_COUNTS:
+            merged[k] += r.get(k, 0)
+        merged["truncated"] = merged.get("truncated") or r.get("truncated", False)
+        for k in ("continuations", "chunks"):
+            if r.get(k):
+                merged[k] = merged.get(k, 0) + r[k]
+        if r.get("chunks_dropped"):
+            merged["chunks_dropped"] = r["chunks_dropped"]  # same pages in every shard
+        if r.get("container"):
+            merged["container"] = r["container"]
+    return merged
+
+
+def chunk_sets(compressed_htmls: list, wantlist: dict = None, synonyms: dict = None) -> tuple:
+    """(page lists for a chunked analysis (one call each), chunks dropped), or (None, 0) when every page fits.
+
+    A page is chunked when it is longer than PAGE_CHARS and retrieval scoping
+    did not shrink it. Call j gets chunk j of every chunked page; pages that
+    fit go whole into the first call. Chunks past chunking.MAX_CHUNKS per page
+    are not sent and are counted as dropped.
+    """
+    if not CHUNK_PAGES:
+        return None, 0
+    wanted = sanitize_wantlist(wantlist) if wantlist else None
+    split = [
+        chunking.split_page(html, PAGE_CHARS)
+        if len(html) > PAGE_CHARS and retrieval.scope_page(html, wanted, PAGE_CHARS, synonyms) is None else [html]
+        for html in compressed_htmls
+    ]
+    if all(len(chunks) == 1 for chunks in split):
+        return None, 0
+    dropped = sum(max(len(chunks) - chunking.MAX_CHUNKS, 0) for chunks in split)
+    split = [chunks[:chunking.MAX_CHUNKS] for chunks in split]
+    return [[chunks[j] for chunks in split if j < len(chunks)] for j in range(max(map(len, split)))], dropped
+
+
+def _analyze_chunked(sets: list, compressed_htmls: list, wantlist: dict, provider, model: str,
+                     temperature: float = None, synonyms: dict = None) -> dict:
+    """Analyze each chunk set concurrently; where chunks disagree on a field, keep
+    the XPath with the best validation hit rate on the full compressed pages."""
+    prompt_prefix, tag = _prompt_prefix(wantlist)
+
+    def run(pages):
+        content = _build_prompt(pages, wantlist, synonyms)
+        result = _generate_parsed(provider, content, _analyze_config(wantlist, temperature), model,
+                                  prompt_prefix, tag)
+        return _complete_truncated(result, pages, wantlist, provider, model, synonyms)
+
+    with ThreadPoolExecutor(max_workers=len(sets)) as executor:
+        results = list(executor.map(run, sets))
+
+    merged = {"mappings": {}, "chunks": len(sets), "truncated": False, **{k: 0 for k in TOKEN_COUNTS}}
+    candidates = {}
+    for r in results:
+        for field, xpath in r["mappings"].items():
+            if xpath not in candidates.setdefault(field, []):
+                candidates[field].append(xpath)
+        for k in TOKEN_COUNTS:
+            merged[k] += r.get(k, 0)
+        merged["truncated"] = merged["truncated"] or r.get("truncated", False)
+        if r.get("continuations"):
+            merged["continuations"] = merged.get("continuations", 0) + r["continuations"]
+
+    container = _detect_root_prefix(compressed_htmls[0]) if compressed_htmls else ""
+    docs = parse_pages([{"url": str(i), "html": html} for i, html in enumerate(compressed_htmls)])
+    containers = {}
+
+    def score(xpath):
+        v = validate_field(_add_prefix({"_": xpath}, container)["_"], docs, containers)
+        return v["confidence"], "warning" not in v, sum(1 for s in v["samples"] if s and s != "(empty)")
+
+    for field, xpaths in candidates.items():
+        # max() keeps the earliest chunk's XPath on ties
+        merged["mappings"][field] = xpaths[0] if len(xpaths) == 1 else max(xpaths, key=score)
+    return merged
+
+
+def analyze(compressed_htmls: list, wantlist: dict = None, api_key: str = None, provider=None,
+            model: str = None, temperature: float = None, synonyms: dict = None) -> dict:
     """Call Gemini API with compressed HTMLs, return {field: xpath} dict.
     
     If wantlist is provided, use targeted mode matching the requested schema.
     Otherwise, discover all extractable fields automatically.
+    provider overrides the LLM backend (default: get_provider(api_key)).
+    model overrides MODEL (e.g. a MODEL_CASCADE tier); temperature overrides ANALYZE_CONFIG's.
+    synonyms is the table retrieval scoping expands field queries with (default synonym_table()).
+    Large want lists are sharded (see shard_wantlist) into concurrent calls;
+    pages over PAGE_CHARS are analyzed in concurrent chunks (see chunk_sets).
     """
-    if not api_key:
-        api_key = _get_api_key()
-
-    if wantlist:
-        wantlist = _sanitize_wantlist(wantlist)
-        content = PROMPT_WANTLIST.format(wantlist=json.dumps(wantlist, ensure_ascii=False, indent=2))
+    if provider is None:
+        provider = make_provider(api_key)
+    model = model or MODEL
+
+    shards = shard_wantlist(wantlist)
+    if len(shards) > 1:
+        return _analyze_sharded(analyze, shards, compressed_htmls, provider, model=model, temperature=temperature,
+                                synonyms=synonyms)
+
+    sets, dropped = chunk_sets(compressed_htmls, wantlist, synonyms)
+    if sets:
+        result = _analyze_chunked(sets, compressed_htmls, wantlist, provider, model, temperature, synonyms)
+        if dropped:
+            result["chunks_dropped"] = dropped
     else:
-        content = PROMPT_DISCOVER
-
-    for i, html in enumerate(compressed_htmls):
-        content += f"\n--- Page {i+1} ---\n{html[:8000]}\n"
-
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL}:generateContent?key={api_key}"
-    payload = {
-        "contents": [{"parts": [{"text": content}]}],
-        "generationConfig": {
-            "temperature": 0.1,
-            "maxOutputTokens": 8192,
-            "responseMimeType": "application/json",
-        }
-    }
-
-    resp = requests.post(url, json=payload, timeout=120)
-    resp.raise_for_status()
-
-    result = _parse_response(resp.json())
+        content = _build_prompt(compressed_htmls, wantlist, synonyms)
+        prefix, tag = _prompt_prefix(wantlist)
+        result = _complete_truncated(
+            _generate_parsed(provider, content, _analyze_config(wantlist, temperature), model, prefix, tag),
+            compressed_htmls, wantlist, provider, model, synonyms)
 
     # Auto-prefix XPaths with main content container
     if compressed_htmls:
@@ -278,3 +711,95 @@ def analyze(compressed_htmls: list, wantlist: dict = None, api_key: str = None)
             result["container"] = prefix
 
     return result
+
+
+def _join_chunks(chunks: list) -> dict:
+    """Merge streamed response chunks into one generateContent-shaped response."""
+    text = ""
+    finish_reason = None
+    usage = {}
+    for chunk in chunks:
+        for cand in chunk.get("candidates", [])[:1]:
+            for part in cand.get("content", {}).get("parts", []):
+                text += part.get("text", "")
+            finish_reason = cand.get("finishReason") or finish_reason
+        usage = chunk.get("usageMetadata") or usage
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}]}, "finishReason": finish_reason}],
+        "usageMetadata": usage,
+    }
+
+
+def _stream(provider, content: str, config: dict, model: str, prefix: str, cache_tag: str):
+    """provider.stream() with the same context-cache handling as _generate()."""
+    cached = context_cache.cached_prefix(provider, model, cache_tag, prefix)
+    if cached and content.startswith(prefix):
+        try:
+            events = provider.stream(content[len(prefix):], model, config, cached_content=cached)
+            first = next(events, None)
+        except Exception as e:
+            if not _cache_rejected(e):
+                raise
+            context_cache.forget(provider, model, cache_tag, prefix)
+        else:
+            if first is not None:
+                yield first
+                yield from events
+            return
+    yield from provider.stream(content, model, config)
+
+
+def analyze_stream(compressed_htmls: list, wantlist: dict = None, api_key: str = None,
+                   provider=None, on_field=None, model: str = None, synonyms: dict = None) -> dict:
+    """Streaming analyze(): on_field(field, xpath) is called as each mapping arrives.
+
+    XPaths passed to on_field are already container-prefixed, exactly as they
+    will appear in the returned mappings. The return value is the same as
+    analyze(), parsed from the complete streamed text. With a sharded want
+    list, on_field is called from several threads.
+    """
+    if provider is None:
+        provider = make_provider(api_key)
+    model = model or MODEL
+
+    shards = shard_wantlist(wantlist)
+    if len(shards) > 1:
+        return _analyze_sharded(analyze_stream, shards, compressed_htmls, provider, on_field=on_field, model=model,
+                                synonyms=synonyms)
+
+    if chunk_sets(compressed_htmls, wantlist, synonyms)[0]:
+        # Chunk results are only final after the merge, so nothing is streamed
+        result = analyze(compressed_htmls, wantlist, provider=provider, model=model, synonyms=synonyms)
+        if on_field is not None:
+            for field, xpath in result["mappings"].items():
+                on_field(field, xpath)
+        return result
+
+    content = _build_prompt(compressed_htmls, wantlist, synonyms)
+    prompt_prefix, tag = _prompt_prefix(wantlist)
+    prefix = _detect_root_prefix(compressed_htmls[0]) if compressed_htmls else ""
+    parser = MappingStreamParser()
+    chunks = []
+    config = _analyze_config(wantlist)
+    metrics.incr("llm_calls")
+    if "responseSchema" in config:
+        metrics.incr("schema_calls")
+    for chunk in _stream(provider, content, config, model, prompt_prefix, tag):
+        chunks.append(chunk)
+        if on_field is None:
+            continue
+        for cand in chunk.get("candidates", [])[:1]:
+            for part in cand.get("content", {}).get("parts", []):
+                for field, xpath in parser.feed(part.get("text", "")):
+                    on_field(field, _add_prefix({field: xpath}, prefix)[field])
+
+    try:
+        result = {**_parse_response(_join_chunks(chunks)), "prompt_tokens_estimated": estimate_tokens(content)}
+    except RuntimeError:
+        metrics.incr("parse_retries")
+        result = _generate_parsed(provider, content, config, model, prompt_prefix, tag)
+    result = _complete_truncated(result, compressed_htmls, wantlist, provider, model, synonyms)
+    if prefix:
+        result["mappings"] = _add_prefix(result["mappings"], prefix)
+        result["container"] = prefix
+    return result
@@ -0,0 +1,194 @@
+"""Record/replay of LLM calls for repeatable experiments.
+
+With XPATHGENIE_CASSETTE set, make_provider() wraps the real provider in a
+CassetteProvider. Each call is keyed by a hash of the model, the generation
+config and the whitespace-normalized prompt; a recorded response is replayed
+without touching the network, a miss goes to the real provider and is
+appended to the cassette. Re-running an experiment after changing only
+reporting or aggregation code then costs no tokens.
+
+The cassette is one gzip-compressed JSON-lines file, appended per call
+(later records win). Provider-side context caching is disabled while a
+cassette is active so the full prompt is always part of the key.
+
+Replaying makes identical prompts return identical answers, so experiments
+that measure run-to-run variance (experiment1_reproducibility) must key
+each run separately: a salt — the "run" field of /api/analyze, or
+XPATHGENIE_CASSETTE_SALT — is added to the key, so run 1, 2 and 3 are
+recorded as independent samples and each replays its own answers.
+Consensus samples 1..N-1 share prompt, model and temperature too, so
+for_sample() tags each one's keys with its sample index.
+
+Environment:
+    XPATHGENIE_CASSETTE       cassette path, e.g. data/cassettes/ablation.jsonl.gz
+    XPATHGENIE_CASSETTE_MODE  "auto" (replay, record misses; default), "replay"
+                              (misses are errors — fully offline) or "record"
+                              (always call and overwrite)
+    XPATHGENIE_CASSETTE_SALT  default salt added to every key (e.g. a run label)
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+from genie import metrics
+from genie.llm import LLMProvider
+
+PATH = os.environ.get("XPATHGENIE_CASSETTE")
+MODE = os.environ.get("XPATHGENIE_CASSETTE_MODE", "auto")
+SALT = os.environ.get("XPATHGENIE_CASSETTE_SALT", "")
+
+_cassettes = {}  # path → Cassette, shared by every provider in the process
+_cassettes_lock = threading.Lock()
+
+
+class CassetteMiss(RuntimeError):
+    """Raised in replay mode for a call that was never recorded."""
+
+
+def call_key(kind: str, prompt: str, model: str, generation_config: dict, salt: str = "") -> str:
+    normalized = " ".join(prompt.split())
+    parts = [kind, model, generation_config, normalized] + ([salt] if salt else [])
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.records = {}
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from an interrupted run
+                    self.records[record["key"]] = record["response"]
+        except (OSError, EOFError):
+            pass
+
+    def get(self, key: str):
+        with self.lock:
+            return self.records.get(key)
+
+    def put(self, key: str, model: str, response):
+        line = json.dumps({"key": key, "model": model, "response": response}, ensure_ascii=False)
+        with self.lock:
+            self.records[key] = response
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+def get_cassette(path: str) -> Cassette:
+    with _cassettes_lock:
+        if path not in _cassettes:
+            _cassettes[path] = Cassette(path)
+        return _cassettes[path]
+
+
+class CassetteProvider(LLMProvider):
+    """Replays recorded calls; forwards misses to the provider built by make_inner()."""
+
+    name = "cassette"
+    supports_cache = False
+
+    def __init__(self, make_inner, path: str, mode: str = "auto", salt: str = ""):
+        super().__init__()
+        self.cassette = get_cassette(path)
+        self.mode = mode
+        self.salt = salt
+        self._make_inner = make_inner
+        self._inner = None
+        self._inner_lock = threading.Lock()
+
+    @property
+    def inner(self) -> LLMProvider:
+        # Built lazily, so a full replay needs no API key
+        with self._inner_lock:
+            if self._inner is None:
+                self._inner = self._make_inner()
+                self.stats = self._inner.stats
+            return self._inner
+
+    def _lookup(self, key: str):
+        if self.mode == "record":
+            return None
+        recorded = self.cassette.get(key)
+        if recorded is not None:
+            metrics.incr("cassette_hits")
+            return recorded
+        metrics.incr("cassette_misses")
+        if self.mode == "replay":
+            raise CassetteMiss(f"No recorded response in {self.cassette.path} for call {key[:12]}")
+        return None
+
+    def generate(self, prompt: str, model: str, generation_config: dict, cached_content: str = None) -> dict:
+        return self.salted_generate(prompt, model, generation_config, self.salt)
+
+    def stream(self, prompt: str, model: str, generation_config: dict, cached_content: str = None):
+        return self.salted_stream(prompt, model, generation_config, self.salt)
+
+    def salted_generate(self, prompt: str, model: str, generation_config: dict, salt: str) -> dict:
+        key = call_key("generate", prompt, model, generation_config, salt)
+        recorded = self._lookup(key)
+        if recorded is not None:
+            return recorded
+        response = self.inner.generate(prompt, model, generation_config)
+        self.cassette.put(key, model, response)
+        return response
+
+    def salted_stream(self, prompt: str, model: str, generation_config: dict, salt: str):
+        key = call_key("stream", prompt, model, generation_config, salt)
+        recorded = self._lookup(key)
+        if recorded is not None:
+            yield from recorded
+            return
+        chunks = []
+        for chunk in self.inner.stream(prompt, model, generation_config):
+            chunks.append(chunk)
+            yield chunk
+        self.cassette.put(key, model, chunks)
+
+
+class _SampleProvider(LLMProvider):
+    """A CassetteProvider whose keys carry a consensus sample index; shares its stats."""
+
+    name = "cassette"
+    supports_cache = False
+
+    def __init__(self, parent: CassetteProvider, index: int):
+        self.parent = parent
+        self.salt = f"{parent.salt}|sample{index}"
+
+    @property
+    def stats(self):
+        return self.parent.stats
+
+    def generate(self, prompt: str, model: str, generation_config: dict, cached_content: str = None) -> dict:
+        return self.parent.salted_generate(prompt, model, generation_config, self.salt)
+
+    def stream(self, prompt: str, model: str, generation_config: dict, cached_content: str = None):
+        return self.parent.salted_stream(prompt, model, generation_config, self.salt)
+
+
+def for_sample(provider: LLMProvider, index: int) -> LLMProvider:
+    """provider for consensus sample index: with a cassette, sample 1.. get keys of their own
+    (sample 0 keeps the plain key, so single-sample recordings still replay)."""
+    if index == 0 or not isinstance(provider, CassetteProvider):
+        return provider
+    return _SampleProvider(provider, index)
+
+
+def wrap(make_provider, salt: str = None) -> LLMProvider:
+    """make_provider() — or, with XPATHGENIE_CASSETTE set, a CassetteProvider around it.
+
+    salt (default XPATHGENIE_CASSETTE_SALT) keeps recordings of separate runs apart.
+    """
+    if not PATH:
+        return make_provider()
+    return CassetteProvider(make_provider, PATH, MODE, SALT if salt is None else salt)
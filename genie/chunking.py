@@ -0,0 +1,65 @@
+"""Split long compressed pages into prompt-sized chunks at element boundaries.
+
+analyze() sends at most PAGE_CHARS of each page, so fields past that point
+could never be mapped. split_page() cuts a page between sibling elements
+(descending into any element that is too big on its own) and heads each
+chunk with the ancestor path it sits under, in the same
+<!-- /ancestor/path --> form as retrieval excerpts.
+"""
+
+from lxml.html import fromstring, tostring
+
+from genie.retrieval import ancestor_path
+
+MAX_CHUNKS = 6  # per page sent to the model; chunk_sets() drops (and reports) the rest
+
+
+def split_page(compressed_html: str, max_chars: int) -> list:
+    """Chunks of at most max_chars covering the whole page, in document order."""
+    if len(compressed_html) <= max_chars:
+        return [compressed_html]
+    try:
+        root = fromstring(compressed_html)
+    except Exception:
+        return [compressed_html[:max_chars]]
+
+    chunks = []
+
+    def walk(parent):
+        buf, size, header = [], 0, ""
+
+        def flush():
+            if buf:
+                chunks.append(header + "".join(buf))
+
+        for child in parent:
+            if not isinstance(child.tag, str):
+                continue
+            html = tostring(child, encoding="unicode", with_tail=True)
+            child_header = f"<!-- {ancestor_path(child)} -->\n"
+            if len(child_header) + len(html) > max_chars:
+                flush()
+                buf, size = [], 0
+                if len(child):
+                    walk(child)
+                else:
+                    chunks.append((child_header + html)[:max_chars])
+                continue
+            if not buf:
+                header = child_header
+            elif size + len(html) > max_chars - len(header):
+                flush()
+                buf, size, header = [], 0, child_header
+            buf.append(html)
+            size += len(html)
+        flush()
+
+    walk(root)
+    # Pack runs of small chunks (left around descended elements) back together
+    packed = []
+    for chunk in chunks:
+        if packed and len(packed[-1]) + 1 + len(chunk) <= max_chars:
+            packed[-1] += "\n" + chunk
+        else:
+            packed.append(chunk)
+    return packed or [compressed_html[:max_chars]]
@@ -1,9 +1,14 @@
 """Compress HTML to minimal structure for AI analysis."""
 
+from copy import deepcopy
+from functools import lru_cache
 from lxml import etree
 from lxml.html import fromstring, tostring
+import hashlib
 import re
 
+from genie import xpath_cache
+
 REMOVE_TAGS = {"script", "style", "noscript", "iframe", "svg", "link", "meta", "head"}
 STRIP_TAGS = {"header", "footer", "nav", "aside"}
 # Class patterns that indicate non-main content (sidebar, recommendations, etc.)
@@ -12,6 +17,43 @@ NOISE_PATTERNS = re.compile(
     re.IGNORECASE
 )
 TEXT_LIMIT = 30
+# Max ranked content sections kept per page for fallback (including the whole document)
+MAX_SECTION_CANDIDATES = 5
+# Levels below the main section included in the template fingerprint
+FINGERPRINT_DEPTH = 3
+
+
+@lru_cache(maxsize=256)
+def compile_selector(selector: str) -> etree.XPath:
+    """Compile a CSS or XPath selector into a reusable etree.XPath.
+
+    Selectors starting with "/" or "(" are treated as XPath, everything else
+    as CSS (e.g. the `div.main > section` paths Jasmine sends).
+    Raises ValueError for empty or invalid selectors.
+    """
+    selector = (selector or "").strip()
+    if not selector:
+        raise ValueError("Empty selector")
+    try:
+        if selector.startswith(("/", "(")):
+            return xpath_cache.compiled(selector)
+        from lxml.cssselect import CSSSelector
+        return CSSSelector(selector)
+    except ImportError:
+        raise ValueError(f"CSS selectors require the cssselect package: {selector}")
+    except Exception as e:
+        raise ValueError(f"Invalid selector {selector!r}: {e}")
+
+
+def _select_elements(doc, selector):
+    """Evaluate a selector (string or compiled) and return element matches only."""
+    if isinstance(selector, str):
+        selector = compile_selector(selector)
+    try:
+        nodes = selector(doc)
+    except Exception:
+        return []
+    return [n for n in nodes if isinstance(getattr(n, 'tag', None), str)]
 
 
 def _safe_text_content(el):
@@ -22,57 +64,97 @@ def _safe_text_content(el):
         return ""
 
 
-def _find_main_section(doc):
-    """Find the primary content section, excluding recommendations/sidebar."""
+def _section_id(doc, el):
+    """Stable identifier for a section: its tree path within the pruned document."""
+    try:
+        return doc.getroottree().getpath(el)
+    except Exception:
+        return el.tag if isinstance(getattr(el, 'tag', None), str) else "?"
+
+
+def _is_related(a, b):
+    """True if a and b are the same element or one contains the other."""
+    if a is b:
+        return True
+    for anc in a.iterancestors():
+        if anc is b:
+            return True
+    for anc in b.iterancestors():
+        if anc is a:
+            return True
+    return False
+
+
+def _rank_main_sections(doc):
+    """Rank candidate content sections, best first.
+
+    Returns [{"id", "el", "sources"}] where "sources" are the document
+    elements a candidate covers (a merged wrapper covers several). The first
+    candidate is what main-section detection has always picked; later ones
+    are distinct regions used for fallback.
+    """
+    ordered = []  # (el, sources)
+
     # Try <main> first
     main = doc.find(".//main")
     if main is None:
         main = doc.find(".//article")
-    
+
     if main is not None:
-        # Within main, find the first large content block that isn't noise
+        # Within main, rank large content blocks that aren't noise
         children = [c for c in main if isinstance(getattr(c, 'tag', ''), str)]
-        best = None
-        best_len = 0
+        blocks = []
         for child in children:
             cls = (child.get("class") or "") + " " + (child.get("id") or "")
             if NOISE_PATTERNS.search(cls):
                 continue
-            text_len = len(_safe_text_content(child))
-            if text_len > best_len:
-                best_len = text_len
-                best = child
-        if best is not None and best_len > 200:
-            return best
-        return main
-    
-    # No main/article — prioritize sections containing structured data (th/td, dt/dd)
-    structured_candidate = _find_structured_section(doc)
-    if structured_candidate is not None:
-        return structured_candidate
-
-    # Fallback: find div with most text, excluding noise
-    best = doc
-    best_len = 0
+            blocks.append((len(_safe_text_content(child)), child))
+        blocks.sort(key=lambda b: -b[0])
+        ordered.extend((el, [el]) for text_len, el in blocks if text_len > 200)
+        ordered.append((main, [main]))
+
+    # Sections containing structured data (th/td, dt/dd)
+    ordered.extend(_rank_structured_sections(doc))
+
+    # Fallback: divs with most text, excluding noise
+    divs = []
     for div in doc.iter("div", "section"):
         cls = (div.get("class") or "") + " " + (div.get("id") or "")
         if NOISE_PATTERNS.search(cls):
             continue
-        text_len = len(_safe_text_content(div))
-        if text_len > best_len:
-            best_len = text_len
-            best = div
-    return best if best_len > 200 else doc
+        divs.append((len(_safe_text_content(div)), div))
+    divs.sort(key=lambda d: -d[0])
+    ordered.extend((el, [el]) for text_len, el in divs if text_len > 200)
+
+    # Keep distinct regions only; the whole document is always the last resort
+    candidates = []
+    for el, sources in ordered:
+        if len(candidates) >= MAX_SECTION_CANDIDATES - 1:
+            break
+        if any(_is_related(s, c_src) for c in candidates for c_src in c["sources"] for s in sources):
+            continue
+        ids = [_section_id(doc, s) for s in sources]
+        candidates.append({"id": "+".join(ids), "el": el, "sources": sources})
+    candidates.append({"id": _section_id(doc, doc), "el": doc, "sources": [doc]})
+    return candidates
 
 
-def _find_structured_section(doc):
-    """Find the nearest common ancestor of structured data elements (th/td, dt/dd).
-    Returns the best container div/section that holds the most structured elements.
-    If no single container is dominant, merges top candidates under a wrapper."""
+def _find_main_section(doc):
+    """Find the primary content section, excluding recommendations/sidebar."""
+    return _rank_main_sections(doc)[0]["el"]
+
+
+def _rank_structured_sections(doc):
+    """Rank containers of structured data elements (th/td, dt/dd), best first.
+
+    Returns [(el, sources)]. If no single container is dominant, a wrapper
+    merging the top candidates comes first, followed by the individual
+    containers. Empty when the page has no usable structured section.
+    """
     # Collect all th and dt elements (these indicate structured data)
     markers = list(doc.iter("th")) + list(doc.iter("dt"))
     if len(markers) < 2:
-        return None
+        return []
 
     # Find parent containers that hold these markers
     # Score each div/section by how many markers it contains
@@ -97,7 +179,7 @@ def _find_structured_section(doc):
             parent = parent.getparent()
 
     if not candidates:
-        return None
+        return []
 
     # Score by marker count * text length (prefer content-rich sections)
     for c in candidates.values():
@@ -107,41 +189,56 @@ def _find_structured_section(doc):
 
     ranked = sorted(candidates.values(), key=lambda c: -c["score"])
     best = ranked[0]
-
-    if best["count"] >= 2:
-        # Check if there are multiple significant sections — merge if no single dominant
-        total_score = sum(c["score"] for c in ranked if c["count"] >= 2)
-        if best["score"] < total_score * 0.5 and len(ranked) > 1:
-            # Merge top sections into a wrapper
-            wrapper = etree.Element("div")
-            added_els = []
-            for cand in ranked:
-                if cand["count"] < 2:
-                    continue
-                el = cand["el"]
-                # Skip if descendant of already-added element
-                skip = False
-                for added in added_els:
-                    p = el.getparent()
-                    while p is not None:
-                        if p is added:
-                            skip = True
-                            break
-                        p = p.getparent()
-                    if skip:
+    if best["count"] < 2:
+        return []
+
+    result = []
+    # Check if there are multiple significant sections — merge if no single dominant
+    total_score = sum(c["score"] for c in ranked if c["count"] >= 2)
+    if best["score"] < total_score * 0.5 and len(ranked) > 1:
+        # Merge top sections into a wrapper
+        wrapper = etree.Element("div")
+        added_els = []
+        for cand in ranked:
+            if cand["count"] < 2:
+                continue
+            el = cand["el"]
+            # Skip if descendant of already-added element
+            skip = False
+            for added in added_els:
+                p = el.getparent()
+                while p is not None:
+                    if p is added:
+                        skip = True
                         break
-                if not skip:
-                    from copy import deepcopy
-                    wrapper.append(deepcopy(el))
-                    added_els.append(el)
-            if len(wrapper) > 0:
-                return wrapper
-        return best["el"]
-    return None
-
-
-def compress(html: str) -> str:
-    """Compress HTML to structural summary of main content only."""
+                    p = p.getparent()
+                if skip:
+                    break
+            if not skip:
+                wrapper.append(deepcopy(el))
+                added_els.append(el)
+        if len(wrapper) > 0:
+            result.append((wrapper, added_els))
+    result.extend((c["el"], [c["el"]]) for c in ranked if c["count"] >= 2)
+    return result
+
+
+def _find_structured_section(doc):
+    """Find the nearest common ancestor of structured data elements (th/td, dt/dd).
+    Returns the best container div/section that holds the most structured elements.
+    If no single container is dominant, merges top candidates under a wrapper."""
+    ranked = _rank_structured_sections(doc)
+    return ranked[0][0] if ranked else None
+
+
+def prepare_sections(html: str, include=None, exclude=None):
+    """Parse and prune HTML once, and rank its candidate content sections.
+
+    Returns {"doc", "candidates": [{"id", "el", "sources"}]} or None if the
+    HTML cannot be parsed. Callers cache the result on the page so that a
+    fallback can re-compress another candidate via compress_section()
+    without re-parsing or re-ranking. See compress() for include/exclude.
+    """
     try:
         doc = fromstring(html)
     except Exception:
@@ -150,29 +247,61 @@ def compress(html: str) -> str:
             if isinstance(html, str):
                 doc = fromstring(html.encode("utf-8"))
             else:
-                return ""
+                return None
         except Exception:
-            return ""
+            return None
+
+    # User-selected scope (e.g. from Jasmine) replaces main-section detection
+    scope = None
+    if include:
+        matches = _select_elements(doc, include)
+        if matches:
+            scope = matches[0]
+
+    # Drop user-excluded elements (selectors are document-relative)
+    for sel in exclude or ():
+        for el in _select_elements(doc, sel):
+            parent = el.getparent()
+            if parent is not None:
+                parent.remove(el)
+
+    root = scope if scope is not None else doc
 
     # Remove unwanted tags
     for tag in REMOVE_TAGS:
-        for el in list(doc.iter(tag)):
+        for el in list(root.iter(tag)):
             parent = el.getparent()
-            if parent is not None:
+            if parent is not None and el is not root:
                 parent.remove(el)
 
     # Remove header/footer/nav/aside
     for tag in STRIP_TAGS:
-        for el in list(doc.iter(tag)):
+        for el in list(root.iter(tag)):
             parent = el.getparent()
-            if parent is not None:
+            if parent is not None and el is not root:
                 parent.remove(el)
 
     # Remove noise sections BEFORE finding main (prevents privacy policy etc. from skewing detection)
-    _remove_noise(doc)
+    _remove_noise(root)
+
+    # Rank main content sections
+    if scope is not None:
+        candidates = [{"id": _section_id(doc, scope), "el": scope, "sources": [scope]}]
+    else:
+        candidates = _rank_main_sections(doc)
+
+    return {"doc": doc, "candidates": candidates}
+
+
+def compress_section(sections, index: int = 0) -> str:
+    """Compress one ranked candidate from prepare_sections() output.
 
-    # Find main content section
-    main = _find_main_section(doc)
+    The cached tree is left untouched so other candidates can be compressed
+    later. Returns "" when the candidate does not exist.
+    """
+    if not sections or index >= len(sections["candidates"]):
+        return ""
+    main = deepcopy(sections["candidates"][index]["el"])
 
     # Remove remaining noise children within main
     _remove_noise(main)
@@ -196,6 +325,46 @@ def compress(html: str) -> str:
     return result
 
 
+def fingerprint(sections) -> str:
+    """Structural fingerprint of a page template from prepare_sections() output.
+
+    Hashes the set of tag/class paths in the top FINGERPRINT_DEPTH levels of
+    the main section (no text, no ids, class tokens containing digits
+    dropped), so pages rendered from the same template share a fingerprint
+    regardless of content or repeat counts.
+    """
+    if not sections:
+        return ""
+    paths = set()
+
+    def walk(el, path, depth):
+        for child in el:
+            if not isinstance(getattr(child, 'tag', None), str):
+                continue
+            classes = sorted(c for c in (child.get("class") or "").split() if not re.search(r"\d", c))
+            child_path = path + "/" + child.tag + "".join("." + c for c in classes)
+            paths.add(child_path)
+            if depth + 1 < FINGERPRINT_DEPTH:
+                walk(child, child_path, depth + 1)
+
+    root = sections["candidates"][0]["el"]
+    walk(root, root.tag if isinstance(root.tag, str) else "", 0)
+    return hashlib.sha1("\n".join(sorted(paths)).encode("utf-8")).hexdigest()[:16]
+
+
+def compress(html: str, include=None, exclude=None) -> str:
+    """Compress HTML to structural summary of main content only.
+
+    Args:
+        include: optional CSS/XPath selector (or compiled selector) for the
+            content scope. When it matches, main-section detection is skipped
+            and only that subtree is pruned and serialized.
+        exclude: optional list of CSS/XPath selectors whose matches are
+            dropped before compression.
+    """
+    return compress_section(prepare_sections(html, include=include, exclude=exclude))
+
+
 def _remove_noise(el):
     """Remove child elements that match noise patterns."""
     for child in list(el):
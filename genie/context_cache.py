@@ -0,0 +1,113 @@
+"""Provider-side context caches for the fixed start of analyze/refine prompts.
+
+The instruction blocks (PROMPT_DISCOVER / PROMPT_WANTLIST with its want list /
+PROMPT_REFINE) are identical across requests; only the page payload changes.
+With XPATHGENIE_CONTEXT_CACHE=1 the prefix is uploaded once as Gemini
+cachedContents and later calls send just the payload plus the cache name.
+
+Handles are kept in a local registry keyed by (provider identity, model,
+tag, prefix hash) — the tag carries the prompt version and want-list hash —
+persisted as JSON so restarts reuse live caches. A handle close to expiry
+has its TTL extended; an expired or rejected one is recreated. A prefix is
+only uploaded once it has been seen CREATE_AFTER times, so one-off prefixes
+(escalation or follow-up want lists) never pay for cache creation.
+
+In practice the shipped prompts are below Gemini's 1024-token floor:
+PROMPT_DISCOVER is ~460 tokens (estimate_tokens), the PROMPT_REFINE prefix
+~335, and a Want List prefix ~540 + ~10 per field. Lists over
+SHARD_THRESHOLD are sharded, so no call carries more than 12 fields and no
+default workload is cached; a prefix clears the floor only when its fields
+carry near-maximal (200-character) descriptions, or with a provider/model
+whose minimum is lower (XPATHGENIE_CONTEXT_CACHE_MIN_TOKENS). Prefixes
+skipped for size are counted as context_cache_too_small.
+
+Environment:
+    XPATHGENIE_CONTEXT_CACHE             "1" to enable
+    XPATHGENIE_CONTEXT_CACHE_TTL         cache lifetime in seconds (default 3600)
+    XPATHGENIE_CONTEXT_CACHE_MIN_TOKENS  smallest prefix worth caching (default 1024,
+                                         Gemini's minimum for 2.5 Flash)
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import Counter
+
+from genie import metrics
+from genie.sampling import estimate_tokens
+from genie.store import CACHE_DIR, JsonStore
+
+ENABLED = os.environ.get("XPATHGENIE_CONTEXT_CACHE") == "1"
+TTL = int(os.environ.get("XPATHGENIE_CONTEXT_CACHE_TTL", 3600))
+MIN_TOKENS = int(os.environ.get("XPATHGENIE_CONTEXT_CACHE_MIN_TOKENS", 1024))
+RENEW_WITHIN = TTL / 4  # extend handles with less than this much life left
+EXPIRY_MARGIN = 60  # treat handles this close to expiry as gone
+CREATE_AFTER = 2  # sightings of a prefix (this process) before a cache is created
+
+STORE_PATH = os.path.join(CACHE_DIR, "context_caches.json")
+
+# {key: {"name": "cachedContents/...", "expires": ts}}
+_store = JsonStore(STORE_PATH)
+_seen = Counter()
+_seen_lock = threading.Lock()
+
+
+def _key(provider, model: str, tag: str, prefix: str) -> str:
+    owner = hashlib.sha1(provider.cache_identity().encode("utf-8")).hexdigest()[:16]
+    prefix_hash = hashlib.sha1(prefix.encode("utf-8")).hexdigest()[:16]
+    return f"{owner}|{model}|{tag}|{prefix_hash}"
+
+
+def cached_prefix(provider, model: str, tag: str, prefix: str):
+    """Name of a live provider cache holding prefix, creating one if needed; None if not cached."""
+    if not ENABLED or not getattr(provider, "supports_cache", False):
+        return None
+    if estimate_tokens(prefix) < MIN_TOKENS:
+        metrics.incr("context_cache_too_small")
+        return None
+    key = _key(provider, model, tag, prefix)
+    now = time.time()
+    with _store.lock:
+        entry = dict(_store.data().get(key) or {})
+    if entry and entry["expires"] - EXPIRY_MARGIN > now:
+        if entry["expires"] - now < RENEW_WITHIN:
+            try:
+                provider.extend_cache(entry["name"], TTL)
+                _remember(key, entry["name"], now + TTL)
+                metrics.incr("context_cache_renewals")
+            except Exception:
+                pass  # still valid for a while; retried on the next call
+        metrics.incr("context_cache_hits")
+        return entry["name"]
+    with _seen_lock:
+        _seen[key] += 1
+        if _seen[key] < CREATE_AFTER:
+            return None
+        if len(_seen) > 10000:
+            _seen.clear()
+    try:
+        name = provider.create_cache(model, prefix, TTL)
+    except Exception:
+        metrics.incr("context_cache_errors")
+        return None
+    _remember(key, name, now + TTL)
+    metrics.incr("context_cache_creates")
+    return name
+
+
+def forget(provider, model: str, tag: str, prefix: str):
+    """Drop a handle the provider rejected (expired or deleted server-side)."""
+    with _store.lock:
+        if _store.data().pop(_key(provider, model, tag, prefix), None) is not None:
+            _store.save()
+
+
+def _remember(key: str, name: str, expires: float):
+    with _store.lock:
+        data = _store.data()
+        data[key] = {"name": name, "expires": expires}
+        now = time.time()
+        for k in [k for k, v in data.items() if v.get("expires", 0) < now]:
+            del data[k]
+        _store.save()
@@ -0,0 +1,71 @@
+"""In-process LRU of parsed pages for interactive endpoints (/api/generalize).
+
+A user clicking through one page sends a request per element; without the
+cache each would re-fetch and re-parse the page and its sibling pages.
+Fetched pages are keyed by URL and kept for TTL seconds; HTML sent in the
+request is keyed by its hash. Cached trees are shared — callers must not
+modify them.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from lxml.html import fromstring
+
+from genie.fetcher import fetch_all
+
+MAX_PAGES = 64
+TTL = 300  # seconds a fetched URL is reused
+
+_cache = OrderedDict()  # key → (expires, doc)
+_lock = threading.Lock()
+
+
+def _get(key: str):
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None or entry[0] < time.time():
+            return None
+        _cache.move_to_end(key)
+        return entry[1]
+
+
+def _put(key: str, doc, ttl: float = TTL):
+    with _lock:
+        _cache[key] = (time.time() + ttl, doc)
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_PAGES:
+            _cache.popitem(last=False)
+
+
+def parsed_html(html: str):
+    """Parsed tree for an HTML string (None if it cannot be parsed)."""
+    key = "html:" + hashlib.sha1(html.encode("utf-8", "replace")).hexdigest()
+    doc = _get(key)
+    if doc is None:
+        try:
+            doc = fromstring(html)
+        except Exception:
+            return None
+        _put(key, doc)
+    return doc
+
+
+def parsed_urls(urls: list) -> list:
+    """[(url, doc or None, error)] for urls, fetching and parsing only cache misses."""
+    docs = {url: _get("url:" + url) for url in urls}
+    missing = [url for url, doc in docs.items() if doc is None]
+    errors = {}
+    for page in fetch_all(missing) if missing else []:
+        if not page["html"]:
+            errors[page["url"]] = page.get("error") or "fetch failed"
+            continue
+        try:
+            docs[page["url"]] = fromstring(page["html"])
+        except Exception as e:
+            errors[page["url"]] = str(e)
+            continue
+        _put("url:" + page["url"], docs[page["url"]])
+    return [(url, docs.get(url), errors.get(url)) for url in urls]
@@ -0,0 +1,76 @@
+"""Incremental parser for streamed {"field": "xpath", ...} model output.
+
+Gemini streams the mapping JSON in arbitrary text chunks. MappingStreamParser
+is fed those chunks and returns each top-level (field, xpath) pair as soon as
+its string value is closed, so callers can validate fields while the rest of
+the object is still being generated. Anything before the first "{" (e.g. a
+```json fence) is skipped; null, numeric and nested values are ignored — the
+complete text is still parsed once at the end by analyzer._parse_response().
+"""
+
+import json
+
+
+class MappingStreamParser:
+    def __init__(self):
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._buf = []
+        self._key = None
+        self._expect_value = False
+
+    def feed(self, chunk: str) -> list:
+        """Consume a text chunk; return the (field, xpath) pairs it completed."""
+        pairs = []
+        for ch in chunk:
+            if self._in_string:
+                if self._escape:
+                    self._buf.append(ch)
+                    self._escape = False
+                elif ch == "\\":
+                    self._buf.append(ch)
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._on_string(self._decode(), pairs)
+                else:
+                    self._buf.append(ch)
+                continue
+
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._buf = []
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+            elif self._depth == 1:
+                if ch == ":":
+                    self._expect_value = True
+                elif ch == ",":
+                    self._key, self._expect_value = None, False
+        return pairs
+
+    def _decode(self) -> str:
+        raw = "".join(self._buf)
+        try:
+            return json.loads(f'"{raw}"')
+        except ValueError:
+            return raw
+
+    def _on_string(self, s: str, pairs: list):
+        if self._depth != 1:
+            return
+        if not self._expect_value:
+            self._key = s
+        elif self._key is not None:
+            pairs.append((self._key, s))
+            self._key, self._expect_value = None, False
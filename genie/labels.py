@@ -0,0 +1,120 @@
+"""Rule-based label/value mapper for dt/dd and th/td layouts (AI cost: 0).
+
+Most job sites expose fields as label/value pairs. The XPaths Gemini is
+asked to write for them (//dt[normalize-space()='給与']/following-sibling::dd[1])
+can be produced directly, so Want List fields whose label is known are
+resolved here and only the rest go to analyze().
+"""
+
+import re
+import unicodedata
+
+from genie.structured import xpath_literal
+
+# Label element → value element that follows it
+PAIR_TAGS = (("dt", "dd"), ("th", "td"))
+MAX_LABEL_LEN = 30
+
+# Wantlist field → page labels that mean it (compared after normalize_label)
+SYNONYMS = {
+    "original_id": ["求人番号", "求人ID", "お仕事No", "お仕事番号", "案件番号", "求人No", "job id"],
+    "access": ["アクセス", "交通", "交通アクセス", "交通手段", "access"],
+    "address": ["住所", "所在地", "勤務地住所", "勤務先住所", "address"],
+    "area": ["勤務地", "エリア", "勤務エリア", "location"],
+    "bonus": ["賞与", "ボーナス", "bonus"],
+    "contract": ["雇用形態", "雇用区分", "契約形態", "employment type", "job type"],
+    "dept": ["部署", "配属部署", "診療科目", "配属先", "department"],
+    "detail": ["仕事内容", "業務内容", "お仕事内容", "職務内容", "job description"],
+    "facility_name": ["施設名", "事業所名", "勤務先", "病院名", "会社名", "法人名", "company"],
+    "facility_type": ["施設形態", "施設種別", "事業所種別", "施設区分", "施設種類", "施設業態"],
+    "holiday": ["休日", "休暇", "休日・休暇", "休日休暇", "休日/休暇", "holidays"],
+    "license": ["資格", "必要資格", "応募資格", "必須資格", "保有資格"],
+    "occupation": ["職種", "募集職種", "occupation"],
+    "position": ["役職", "ポジション", "position"],
+    "price": ["給与", "給料", "月給", "時給", "年収", "報酬", "賃金", "給与詳細", "想定年収", "給与例", "salary", "pay"],
+    "price_rule": ["手当", "諸手当", "給与備考", "昇給", "昇給・賞与", "各種手当"],
+    "required_skill": ["応募条件", "求めるスキル", "必須スキル", "歓迎スキル", "応募要件", "requirements"],
+    "station": ["最寄駅", "最寄り駅", "最寄駅・路線", "station"],
+    "line": ["路線", "沿線", "路線名"],
+    "test_period": ["試用期間"],
+    "welfare_program": ["福利厚生", "待遇", "待遇・福利厚生", "福利厚生・待遇", "benefits"],
+    "working_hours": ["勤務時間", "就業時間", "勤務時間帯", "working hours"],
+    "working_style": ["勤務形態", "勤務体制", "勤務シフト", "シフト"],
+}
+
+_XPATH_WS = re.compile(r"[ \t\r\n]+")
+
+
+def normalize_label(text: str) -> str:
+    """Normalize label text for lookup: NFKC, lowercase, no spaces or trailing colons."""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = re.sub(r"\s+", "", text)
+    return text.rstrip(":：")
+
+
+def normalize_space(text: str) -> str:
+    """Python equivalent of XPath normalize-space() (XML whitespace only)."""
+    return _XPATH_WS.sub(" ", text or "").strip(" \t\r\n")
+
+
+def find_label_pairs(root) -> dict:
+    """List label/value pairs under root as {label: xpath}.
+
+    Only labels followed by a non-empty value element are kept; the label
+    text is the normalize-space() value the XPath matches on.
+    """
+    pairs = {}
+    for label_tag, value_tag in PAIR_TAGS:
+        for label_el in root.iter(label_tag):
+            label = normalize_space(label_el.text_content())
+            if not label or len(label) > MAX_LABEL_LEN or label in pairs:
+                continue
+            value_el = label_el.getnext()
+            while value_el is not None and not isinstance(value_el.tag, str):
+                value_el = value_el.getnext()
+            if value_el is None or value_el.tag != value_tag:
+                continue
+            if not value_el.text_content().strip():
+                continue
+            pairs[label] = (f"//{label_tag}[normalize-space()={xpath_literal(label)}]"
+                            f"/following-sibling::{value_tag}[1]")
+    return pairs
+
+
+def common_label_pairs(roots: list) -> dict:
+    """Label/value pairs present on every sample page, as {label: xpath}."""
+    if not roots:
+        return {}
+    common = find_label_pairs(roots[0])
+    for root in roots[1:]:
+        pairs = find_label_pairs(root)
+        common = {label: xpath for label, xpath in common.items() if pairs.get(label) == xpath}
+    return common
+
+
+def match_labels(pairs: dict, wantlist: dict, synonyms: dict = None) -> dict:
+    """Resolve wantlist fields to label XPaths.
+
+    A field matches a label listed for it in the synonym table, its own name,
+    or its wantlist description (text before any parenthesized examples).
+
+    Returns:
+        {field: xpath} for resolved fields.
+    """
+    synonyms = SYNONYMS if synonyms is None else synonyms
+    by_label = {}
+    for label, xpath in pairs.items():
+        by_label.setdefault(normalize_label(label), xpath)
+
+    result = {}
+    for field, desc in wantlist.items():
+        candidates = [field] + list(synonyms.get(field, []))
+        hint = re.split(r"[（(]", str(desc or ""), 1)[0]
+        if hint.strip():
+            candidates.insert(1, hint)
+        for cand in candidates:
+            xpath = by_label.get(normalize_label(cand))
+            if xpath:
+                result[field] = xpath
+                break
+    return result
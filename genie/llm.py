@@ -0,0 +1,416 @@
+"""LLM provider interface used by the analyzer.
+
+analyze() and refine() talk to a provider instead of calling the Gemini REST
+API directly, so the pipeline can run against a local stub server
+(scripts/llm_stub_server.py) for offline load tests and benchmarks.
+
+Providers return Gemini-format response dicts:
+    {"candidates": [{"content": {"parts": [{"text": ...}]}, "finishReason": ...}],
+     "usageMetadata": {"promptTokenCount": ..., "candidatesTokenCount": ..., "totalTokenCount": ...}}
+
+LLM traffic goes through shared keep-alive clients, one pool per API key, so
+analyze() and refine() in the same request reuse the TLS connection.
+
+Calls are wrapped in a resilience layer (call_with_resilience): retryable
+errors (429, 5xx, connection failures) are retried with jittered exponential
+backoff honouring Retry-After, a call slower than the recent latency
+percentile gets a hedged duplicate, and a per-key circuit breaker fails fast
+while the endpoint keeps failing. Each provider counts its retries/hedges in
+provider.stats.
+
+Environment:
+    XPATHGENIE_LLM_PROVIDER          provider name (default "gemini")
+    XPATHGENIE_LLM_BASE_URL          Gemini-compatible endpoint, e.g. http://127.0.0.1:8790 for the stub
+    XPATHGENIE_LLM_CONNECT_TIMEOUT   connect timeout in seconds (default 10)
+    XPATHGENIE_LLM_READ_TIMEOUT      read timeout in seconds (default 120)
+    XPATHGENIE_LLM_HTTP2             "1" to multiplex over HTTP/2 (requires httpx[http2])
+    XPATHGENIE_LLM_STREAM            "1" to stream analyze() output (streamGenerateContent)
+    XPATHGENIE_LLM_MAX_RETRIES       retries per call on retryable errors (default 3)
+    XPATHGENIE_LLM_HEDGE_PERCENTILE  latency percentile that triggers a hedged request (default 95, 0 = off)
+"""
+
+import email.utils
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from genie import metrics
+
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com"
+CONNECT_TIMEOUT = float(os.environ.get("XPATHGENIE_LLM_CONNECT_TIMEOUT", 10))
+READ_TIMEOUT = float(os.environ.get("XPATHGENIE_LLM_READ_TIMEOUT", 120))
+USE_HTTP2 = os.environ.get("XPATHGENIE_LLM_HTTP2") == "1"
+USE_STREAMING = os.environ.get("XPATHGENIE_LLM_STREAM") == "1"
+POOL_SIZE = 10  # keep-alive connections per API key
+MAX_CLIENTS = 64  # API keys with a live pool; least recently used is dropped first
+
+MAX_RETRIES = int(os.environ.get("XPATHGENIE_LLM_MAX_RETRIES", 3))
+BACKOFF_BASE = 0.5  # seconds; doubled per attempt, full jitter
+BACKOFF_MAX = 8.0
+MAX_RETRY_AFTER = 30.0  # a longer Retry-After fails the call instead of holding the thread
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+HEDGE_PERCENTILE = float(os.environ.get("XPATHGENIE_LLM_HEDGE_PERCENTILE", 95))
+HEDGE_MIN_SAMPLES = 20  # no hedging until this many latencies are known
+HEDGE_MIN_DELAY = 1.0  # never hedge sooner than this (s)
+BREAKER_THRESHOLD = 5  # consecutive retryable failures that open a key's circuit
+BREAKER_COOLDOWN = 30.0  # seconds the circuit stays open before a trial call
+
+_TRANSIENT = (requests.ConnectionError, requests.Timeout)
+try:
+    import httpx
+    _TRANSIENT += (httpx.TransportError,)
+except ImportError:
+    pass
+
+_clients = OrderedDict()  # api_key → requests.Session | httpx.Client
+_clients_lock = threading.Lock()
+
+
+def _new_client():
+    """Keep-alive client: httpx over HTTP/2 when enabled and installed, else a pooled requests.Session."""
+    if USE_HTTP2:
+        try:
+            import httpx
+            return httpx.Client(
+                http2=True,
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+            )
+        except ImportError:
+            pass  # httpx or h2 missing — fall back to HTTP/1.1 keep-alive
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_client(api_key: str):
+    """Shared, thread-safe client for an API key (created on first use)."""
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is not None:
+            _clients.move_to_end(api_key)
+            return client
+        client = _new_client()
+        _clients[api_key] = client
+        if len(_clients) > MAX_CLIENTS:
+            # Not closed explicitly: another thread may still be mid-request on it
+            _clients.popitem(last=False)
+        return client
+
+
+def post_json(client, url: str, payload: dict, method: str = "POST") -> dict:
+    """Send JSON with separate connect/read timeouts; raise on HTTP errors."""
+    if isinstance(client, requests.Session):
+        resp = client.request(method, url, json=payload, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+    else:
+        resp = client.request(method, url, json=payload)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _sse_events(lines):
+    """Yield the JSON payload of each `data:` line of a server-sent event stream."""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if line.startswith("data:"):
+            data = line[5:].strip()
+            if data and data != "[DONE]":
+                yield json.loads(data)
+
+
+def post_stream(client, url: str, payload: dict):
+    """POST JSON and yield the decoded server-sent events as they arrive."""
+    if isinstance(client, requests.Session):
+        with client.post(url, json=payload, stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as resp:
+            resp.raise_for_status()
+            yield from _sse_events(resp.iter_lines())
+    else:
+        with client.stream("POST", url, json=payload) as resp:
+            resp.raise_for_status()
+            yield from _sse_events(resp.iter_lines())
+
+
+class CircuitOpenError(RuntimeError):
+    """The circuit for this API key is open — the LLM endpoint is failing."""
+
+
+class CallStats:
+    """Thread-safe per-provider counters (retries, hedges, circuit_open)."""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, name: str):
+        with self._lock:
+            self._counts[name] += 1
+        metrics.incr(f"llm_{name}")
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+
+_latencies = deque(maxlen=200)  # recent successful call latencies (s)
+_breakers = {}  # api_key → {"failures": int, "opened_at": float}
+_resilience_lock = threading.Lock()
+HEDGE_WORKERS = 16
+_hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+_hedge_slots = threading.BoundedSemaphore(HEDGE_WORKERS)  # a hedge that would queue is not sent
+
+
+def http_status(exc):
+    """HTTP status code carried by a requests/httpx error, or None."""
+    return getattr(getattr(exc, "response", None), "status_code", None)
+
+
+def _is_retryable(exc) -> bool:
+    status = http_status(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return isinstance(exc, _TRANSIENT)
+
+
+def _retry_after(exc):
+    """Seconds from a Retry-After header (delta or HTTP date), or None."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _breaker_check(key: str):
+    with _resilience_lock:
+        b = _breakers.get(key)
+        if b and b["failures"] >= BREAKER_THRESHOLD and time.time() - b["opened_at"] < BREAKER_COOLDOWN:
+            raise CircuitOpenError("LLM endpoint failing repeatedly; circuit open")
+
+
+def _breaker_record(key: str, ok: bool):
+    with _resilience_lock:
+        if ok:
+            _breakers.pop(key, None)
+            return
+        b = _breakers.setdefault(key, {"failures": 0, "opened_at": 0.0})
+        b["failures"] += 1
+        if b["failures"] >= BREAKER_THRESHOLD:
+            b["opened_at"] = time.time()  # (re)open; a failed half-open trial restarts the cooldown
+
+
+def _hedge_delay():
+    """Latency at HEDGE_PERCENTILE of recent calls, or None while hedging is off."""
+    if HEDGE_PERCENTILE <= 0:
+        return None
+    with _resilience_lock:
+        samples = sorted(_latencies)
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    idx = min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE / 100))
+    return max(HEDGE_MIN_DELAY, samples[idx])
+
+
+def _timed(fn):
+    t0 = time.time()
+    result = fn()
+    with _resilience_lock:
+        _latencies.append(time.time() - t0)
+    return result
+
+
+def _run_into(future: Future, fn):
+    try:
+        future.set_result(_timed(fn))
+    except BaseException as e:
+        future.set_exception(e)
+
+
+def _hedge_call(fn):
+    try:
+        return _timed(fn)
+    finally:
+        _hedge_slots.release()
+
+
+def _hedged(fn, stats: CallStats):
+    """Run fn; if it outlives the latency percentile, race a duplicate and take the first result.
+
+    The primary starts at once on its own (unpooled) thread, so the hedge
+    delay counts from when the call really starts and primaries never queue
+    behind each other; only the duplicate uses _hedge_pool, and it is
+    skipped when every hedge worker is busy.
+    """
+    delay = _hedge_delay()
+    if delay is None:
+        return _timed(fn)
+    primary = Future()
+    threading.Thread(target=_run_into, args=(primary, fn), name="llm-primary", daemon=True).start()
+    try:
+        return primary.result(timeout=delay)
+    except FutureTimeout:
+        pass
+    if not _hedge_slots.acquire(blocking=False):
+        return primary.result()
+    stats.incr("hedges")
+    hedge = _hedge_pool.submit(_hedge_call, fn)
+    done, pending = wait([primary, hedge], return_when=FIRST_COMPLETED)
+    first = done.pop()
+    if first.exception() is None or not pending:
+        return first.result()
+    return pending.pop().result()  # first one failed — fall back to the other
+
+
+def call_with_resilience(key: str, fn, stats: CallStats, hedge: bool = True):
+    """Call fn() with circuit breaking, retries with backoff and optional hedging."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            _breaker_check(key)
+        except CircuitOpenError:
+            stats.incr("circuit_open")
+            raise
+        try:
+            result = _hedged(fn, stats) if hedge else fn()
+        except Exception as e:
+            if not _is_retryable(e):
+                raise
+            _breaker_record(key, ok=False)
+            wait_s = _retry_after(e)
+            if attempt == MAX_RETRIES or (wait_s is not None and wait_s > MAX_RETRY_AFTER):
+                raise
+            stats.incr("retries")
+            time.sleep(wait_s if wait_s is not None else _backoff(attempt))
+            continue
+        _breaker_record(key, ok=True)
+        return result
+
+
+def _open_stream(events):
+    """Pull the first event so connection/HTTP errors surface inside the retry loop."""
+    first = next(events, None)
+    return first, events
+
+
+class LLMProvider:
+    """Send one prompt to a model and return a Gemini-format response dict.
+
+    cached_content names a provider-side cache holding the start of the
+    prompt (see genie.context_cache); prompt is then only the remainder.
+    """
+
+    name = "base"
+    supports_cache = False
+
+    def __init__(self):
+        self.stats = CallStats()
+
+    def generate(self, prompt: str, model: str, generation_config: dict, cached_content: str = None) -> dict:
+        raise NotImplementedError
+
+    def stream(self, prompt: str, model: str, generation_config: dict, cached_content: str = None):
+        """Yield Gemini-format response chunks; providers without streaming yield one."""
+        yield self.generate(prompt, model, generation_config, cached_content)
+
+    def cache_identity(self) -> str:
+        """Who owns provider-side caches created through this provider."""
+        return self.name
+
+    def create_cache(self, model: str, text: str, ttl: int) -> str:
+        """Store text as a cached prompt prefix for ttl seconds; return its name."""
+        raise NotImplementedError
+
+    def extend_cache(self, name: str, ttl: int):
+        """Reset a cache's time-to-live to ttl seconds from now."""
+        raise NotImplementedError
+
+
+class GeminiProvider(LLMProvider):
+    """Gemini generateContent over REST (also used for Gemini-compatible stubs)."""
+
+    name = "gemini"
+
+    def __init__(self, api_key: str, base_url: str = None):
+        super().__init__()
+        self.api_key = api_key
+        self.base_url = (base_url or os.environ.get("XPATHGENIE_LLM_BASE_URL") or GEMINI_BASE_URL).rstrip("/")
+        self.client = get_client(api_key)
+
+    supports_cache = True
+
+    def cache_identity(self) -> str:
+        return f"{self.base_url}|{self.api_key}"
+
+    @staticmethod
+    def _payload(prompt: str, generation_config: dict, cached_content: str = None) -> dict:
+        payload = {
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "generationConfig": generation_config,
+        }
+        if cached_content:
+            payload["cachedContent"] = cached_content
+        return payload
+
+    def generate(self, prompt: str, model: str, generation_config: dict, cached_content: str = None) -> dict:
+        url = f"{self.base_url}/v1beta/models/{model}:generateContent?key={self.api_key}"
+        payload = self._payload(prompt, generation_config, cached_content)
+        return call_with_resilience(self.api_key, lambda: post_json(self.client, url, payload), self.stats)
+
+    def create_cache(self, model: str, text: str, ttl: int) -> str:
+        url = f"{self.base_url}/v1beta/cachedContents?key={self.api_key}"
+        payload = {
+            "model": f"models/{model}",
+            "contents": [{"role": "user", "parts": [{"text": text}]}],
+            "ttl": f"{int(ttl)}s",
+        }
+        # Not hedged: a duplicate would create (and bill) a second cache
+        return call_with_resilience(self.api_key, lambda: post_json(self.client, url, payload), self.stats,
+                                    hedge=False)["name"]
+
+    def extend_cache(self, name: str, ttl: int):
+        url = f"{self.base_url}/v1beta/{name}?updateMask=ttl&key={self.api_key}"
+        call_with_resilience(self.api_key, lambda: post_json(self.client, url, {"ttl": f"{int(ttl)}s"}, "PATCH"),
+                             self.stats, hedge=False)
+
+    def stream(self, prompt: str, model: str, generation_config: dict, cached_content: str = None):
+        url = f"{self.base_url}/v1beta/models/{model}:streamGenerateContent?alt=sse&key={self.api_key}"
+        payload = self._payload(prompt, generation_config, cached_content)
+        # Retried until the first event arrives; a stream that breaks midway is not replayed
+        first, events = call_with_resilience(
+            self.api_key, lambda: _open_stream(post_stream(self.client, url, payload)), self.stats, hedge=False)
+        if first is not None:
+            yield first
+            yield from events
+
+
+PROVIDERS = {
+    "gemini": GeminiProvider,
+}
+
+
+def get_provider(api_key: str, name: str = None) -> LLMProvider:
+    """Build the configured provider for an API key."""
+    name = name or os.environ.get("XPATHGENIE_LLM_PROVIDER", "gemini")
+    if name not in PROVIDERS:
+        raise RuntimeError(f"Unknown LLM provider: {name}")
+    return PROVIDERS[name](api_key)
@@ -0,0 +1,32 @@
+"""Process-wide counters for LLM call outcomes, served at GET /api/metrics.
+
+Counters:
+    llm_calls             generate/stream calls made by analyze() and refine()
+    schema_calls          calls sent with a responseSchema
+    parse_ok              responses that parsed as JSON directly
+    parse_repaired        responses that needed fence stripping or brace scanning
+    parse_failures        responses that could not be parsed at all
+    parse_retries         calls re-issued after a parse failure
+    llm_retries           attempts retried after 429/5xx/connection errors
+    llm_hedges            hedged duplicate requests sent for slow calls
+    llm_circuit_open      calls failed fast by an open circuit
+    refine_cache_hits     fields refined from genie.refine_cache without an LLM call
+    cassette_hits         LLM calls replayed from a genie.cassette recording
+    cassette_misses       LLM calls not found in the cassette
+"""
+
+import threading
+from collections import Counter
+
+_counts = Counter()
+_lock = threading.Lock()
+
+
+def incr(name: str, n: int = 1):
+    with _lock:
+        _counts[name] += n
+
+
+def snapshot() -> dict:
+    with _lock:
+        return dict(_counts)
@@ -0,0 +1,73 @@
+"""Cache of AI-refined XPaths keyed by (field, xpath, context structure).
+
+The same ambiguity — one XPath matching both the job-detail block and a
+summary box, say — recurs on every page of a template. The key hashes the
+tag/class skeleton of the match contexts, not their text, so a refinement
+found once is reused for other pages and later requests at no token cost.
+
+Only refinements that re-validated as unique without losing confidence are
+stored; a cached one that later fails validation is forgotten.
+"""
+
+import hashlib
+import os
+import time
+
+from genie.sampling import structure_signature
+from genie.store import CACHE_DIR, CACHE_ENABLED, JsonStore
+
+STORE_PATH = os.environ.get("XPATHGENIE_REFINE_CACHE_PATH", os.path.join(CACHE_DIR, "refine.json"))
+MAX_ENTRIES = 2000
+
+# {key: {"xpath": refined_xpath, "model": producing model, "used": ts}}
+_store = JsonStore(STORE_PATH)
+
+
+def context_hash(contexts: list) -> str:
+    """Structural hash of the match contexts of a field across pages."""
+    paths = set()
+    for ctx in contexts:
+        for snippet in ctx.get("snippets", []):
+            paths |= structure_signature(snippet)
+    return hashlib.sha1("\n".join(sorted(paths)).encode("utf-8")).hexdigest()[:16]
+
+
+def refine_key(field: str, info: dict) -> str:
+    return f"{field}|{info['xpath']}|{context_hash(info.get('contexts', []))}"
+
+
+def lookup(key: str):
+    """Cached {"xpath", "model"} for key ("model" missing in older entries), or None."""
+    if not CACHE_ENABLED:
+        return None
+    with _store.lock:
+        entry = _store.data().get(key)
+        if not entry:
+            return None
+        entry["used"] = time.time()
+        return {k: entry[k] for k in ("xpath", "model") if k in entry}
+
+
+def store(entries: dict):
+    """Cache {key: {"xpath": refined_xpath, "model": producing model}}."""
+    if not entries or not CACHE_ENABLED:
+        return
+    with _store.lock:
+        data = _store.data()
+        now = time.time()
+        for key, entry in entries.items():
+            data[key] = {**entry, "used": now}
+        if len(data) > MAX_ENTRIES:
+            for old in sorted(data, key=lambda k: data[k].get("used", 0))[:len(data) - MAX_ENTRIES]:
+                del data[old]
+        _store.save()
+
+
+def forget(keys: list):
+    """Drop cached refinements (e.g. ones that no longer validate)."""
+    if not keys or not CACHE_ENABLED:
+        return
+    with _store.lock:
+        data = _store.data()
+        if any(data.pop(key, None) for key in keys):
+            _store.save()
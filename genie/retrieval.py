@@ -0,0 +1,169 @@
+"""Retrieval-scoped prompting: send only the DOM regions relevant to a Want List.
+
+A compressed page is cut into small regions (the largest ancestor of each
+text-bearing element that still fits in REGION_CHARS) and indexed locally with
+BM25 over their text, class and id tokens. Each wanted field is turned into a
+query from its name, its description and its built-in plus learned synonyms;
+the TOP_REGIONS best regions per field are kept, in document order, each
+preceded by its ancestor path. Prompt size then grows with the number of
+wanted fields rather than with the page.
+
+Pages where too few fields find any region, or where the excerpt would not
+be smaller than the page, are sent whole.
+
+Environment:
+    XPATHGENIE_RETRIEVAL  "0" to always send whole pages
+"""
+
+import math
+import os
+import re
+from collections import Counter
+
+from lxml.html import fromstring, tostring
+
+from genie.synonyms import synonym_table
+
+ENABLED = os.environ.get("XPATHGENIE_RETRIEVAL", "1") != "0"
+REGION_CHARS = 600  # largest region (serialized) kept as one excerpt
+TOP_REGIONS = 3  # regions per wanted field
+MIN_COVERAGE = 0.5  # share of fields that must hit some region to scope a page
+LABEL_CHARS = 30  # a short region directly followed by a sibling region is a label for it
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD = re.compile(r"[a-z0-9]+")
+_NON_ASCII_RUN = re.compile(r"[^\x00-\x7f]+")
+_CAMEL = re.compile(r"([a-z])([A-Z])")
+
+# Label/value tags that end up as separate regions when their list is too big
+_PAIRS = {("dt", "dd"), ("th", "td"), ("td", "td")}
+
+
+def tokenize(text: str) -> list:
+    """Lowercase ASCII words (snake/kebab/camelCase split) plus bigrams of non-ASCII runs."""
+    if not text:
+        return []
+    text = _CAMEL.sub(r"\1 \2", text)
+    tokens = _WORD.findall(text.lower())
+    for run in _NON_ASCII_RUN.findall(text):
+        run = "".join(run.split())
+        if len(run) == 1:
+            tokens.append(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def field_query(field: str, description, synonyms: dict) -> list:
+    return tokenize(" ".join([field.replace("_", " "), str(description or "")] + synonyms.get(field, [])))
+
+
+def _serialized_len(el, sizes: dict) -> int:
+    if el not in sizes:
+        sizes[el] = len(tostring(el, encoding="unicode", with_tail=False))
+    return sizes[el]
+
+
+def ancestor_path(el) -> str:
+    """/tag[@class='...']/... path of el's ancestors (el itself excluded)."""
+    steps = []
+    for node in reversed(list(el.iterancestors())):
+        cls = node.get("class")
+        steps.append(f"{node.tag}[@class='{cls}']" if cls else node.tag)
+    return "/" + "/".join(steps)
+
+
+def regions(compressed_html: str) -> list:
+    """Disjoint excerpt-sized regions of a page, in document order."""
+    try:
+        root = fromstring(compressed_html)
+    except Exception:
+        return []
+    sizes = {}
+    found = []
+    seen = set()
+    for el in root.iter():
+        if not isinstance(el.tag, str) or el is root:
+            continue
+        if not (el.text or "").strip() and not any((c.tail or "").strip() for c in el):
+            continue
+        region = el
+        parent = region.getparent()
+        while parent is not None and parent is not root and _serialized_len(parent, sizes) <= REGION_CHARS:
+            region = parent
+            parent = region.getparent()
+        if region not in seen:
+            seen.add(region)
+            found.append(region)
+    return found
+
+
+def _is_pair(label, value) -> bool:
+    """True if value directly follows label and label looks like its caption."""
+    nxt = label.getnext()
+    if nxt is None or (value is not nxt and nxt not in value.iterancestors()):
+        return False
+    return (label.tag, nxt.tag) in _PAIRS or len(label.text_content().strip()) <= LABEL_CHARS
+
+
+def _index_text(el) -> str:
+    attrs = " ".join(
+        f"{node.get('class') or ''} {node.get('id') or ''}" for node in el.iter() if isinstance(node.tag, str))
+    return f"{el.text_content()} {attrs}"
+
+
+def scope_page(compressed_html: str, wantlist: dict, max_chars: int, synonyms: dict = None) -> str:
+    """Excerpt of the page relevant to wantlist, or None to send the page whole.
+
+    synonyms is the table that expands field queries (default synonym_table()).
+    """
+    if not ENABLED or not wantlist:
+        return None
+    found = regions(compressed_html)
+    if len(found) < 2:
+        return None
+
+    docs = [Counter(tokenize(_index_text(el))) for el in found]
+    avg_len = sum(sum(d.values()) for d in docs) / len(docs) or 1
+    df = Counter(t for d in docs for t in d)
+    n = len(docs)
+
+    def score(doc: Counter, query: list) -> float:
+        length = sum(doc.values())
+        total = 0.0
+        for t in set(query):
+            tf = doc.get(t, 0)
+            if tf:
+                idf = math.log(1 + (n - df[t] + 0.5) / (df[t] + 0.5))
+                total += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len))
+        return total
+
+    synonyms = synonym_table() if synonyms is None else synonyms
+    keep = set()
+    hits = 0
+    for field, description in wantlist.items():
+        query = field_query(field, description, synonyms)
+        scored = sorted(((score(d, query), i) for i, d in enumerate(docs)), reverse=True)
+        top = [i for s, i in scored[:TOP_REGIONS] if s > 0]
+        if top:
+            hits += 1
+            keep.update(top)
+    if hits < MIN_COVERAGE * len(wantlist):
+        return None
+    # A label without its value (or the reverse) is useless to the model
+    for i in list(keep):
+        if i + 1 < n and _is_pair(found[i], found[i + 1]):
+            keep.add(i + 1)
+        if i > 0 and _is_pair(found[i - 1], found[i]):
+            keep.add(i - 1)
+
+    parts = []
+    for i in sorted(keep):
+        part = f"<!-- {ancestor_path(found[i])} -->\n" + tostring(found[i], encoding="unicode", with_tail=False)[:REGION_CHARS]
+        if part not in parts:
+            parts.append(part)
+    text = "\n".join(parts)
+    if len(text) >= min(len(compressed_html), max_chars):
+        return None
+    return text
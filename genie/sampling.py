@@ -0,0 +1,91 @@
+"""Pre-flight prompt sizing and sample page selection.
+
+Users often send 10 URLs of one template when two or three structurally
+distinct pages carry all the information the model needs. Before the
+analyze call the compressed pages are sized with a local token estimate and
+a subset is picked greedily for structural diversity (farthest-first on the
+Jaccard distance of tag.class paths) within a token budget. Pages that add
+no new structure, or do not fit, are left out of the prompt — validation
+still runs on every fetched page.
+"""
+
+import os
+import re
+
+from lxml.html import fromstring
+
+TOKEN_BUDGET = int(os.environ.get("XPATHGENIE_PROMPT_TOKEN_BUDGET", 16000))
+MIN_NOVELTY = 0.05  # pages closer than this to every selected page are redundant
+MIN_PAGES = 2  # keep at least this many (budget permitting) so the model sees page-to-page variation
+
+ASCII_CHARS_PER_TOKEN = 4  # markup and English
+NON_ASCII_TOKENS_PER_CHAR = 1.0  # Japanese text is roughly one token per character
+
+_NON_ASCII = re.compile(r"[^\x00-\x7f]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough Gemini token count for a prompt (no network call)."""
+    if not text:
+        return 0
+    non_ascii = len(_NON_ASCII.findall(text))
+    return int((len(text) - non_ascii) / ASCII_CHARS_PER_TOKEN + non_ascii * NON_ASCII_TOKENS_PER_CHAR) + 1
+
+
+def structure_signature(compressed_html: str) -> frozenset:
+    """Set of tag.class paths in a compressed page (class tokens with digits dropped)."""
+    try:
+        root = fromstring(compressed_html)
+    except Exception:
+        return frozenset()
+    paths = set()
+    stack = [(root, "")]
+    while stack:
+        el, prefix = stack.pop()
+        if not isinstance(el.tag, str):
+            continue
+        cls = ".".join(sorted(c for c in (el.get("class") or "").split() if not any(ch.isdigit() for ch in c)))
+        path = f"{prefix}/{el.tag}{'.' + cls if cls else ''}"
+        paths.add(path)
+        stack.extend((child, path) for child in el)
+    return frozenset(paths)
+
+
+def _distance(a: frozenset, b: frozenset) -> float:
+    if not a and not b:
+        return 0.0
+    return 1.0 - len(a & b) / len(a | b)
+
+
+def select_pages(page_texts: list, base_tokens: int = 0, budget: int = None) -> list:
+    """Indices of the pages to send, in original order.
+
+    Args:
+        page_texts: compressed pages exactly as they will appear in the prompt
+        base_tokens: estimated tokens of the prompt without any page
+        budget: prompt token budget (default TOKEN_BUDGET)
+
+    The first non-empty page is always kept (analyze() derives the container
+    prefix from it); the rest are added most-novel first while they fit,
+    until only redundant pages remain and MIN_PAGES are selected.
+    """
+    budget = budget or TOKEN_BUDGET
+    candidates = [i for i, text in enumerate(page_texts) if text]
+    if not candidates:
+        return []
+    costs = {i: estimate_tokens(page_texts[i]) for i in candidates}
+    sigs = {i: structure_signature(page_texts[i]) for i in candidates}
+
+    selected = [candidates[0]]
+    used = base_tokens + costs[candidates[0]]
+    remaining = candidates[1:]
+    while remaining:
+        novelty = {i: min(_distance(sigs[i], sigs[j]) for j in selected) for i in remaining}
+        best = max(remaining, key=lambda i: (novelty[i], -i))
+        if novelty[best] < MIN_NOVELTY and len(selected) >= MIN_PAGES:
+            break
+        remaining.remove(best)
+        if used + costs[best] <= budget:
+            selected.append(best)
+            used += costs[best]
+    return sorted(selected)
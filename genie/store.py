@@ -0,0 +1,45 @@
+"""Small persistent JSON stores for learned data and caches.
+
+Each store is one JSON object on disk, loaded lazily and rewritten
+atomically on save. Callers hold store.lock while reading or mutating
+store.data() and calling save().
+
+XPATHGENIE_NO_CACHE=1 turns off the learned stores (template cache, learned
+synonyms, refine cache) for the whole process, e.g. for evaluation runs;
+/api/analyze also accepts "cache": false per request.
+"""
+
+import json
+import os
+import threading
+
+CACHE_DIR = os.environ.get("XPATHGENIE_CACHE_DIR", os.path.expanduser("~/.cache/xpathgenie"))
+CACHE_ENABLED = os.environ.get("XPATHGENIE_NO_CACHE") != "1"
+
+
+class JsonStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self._data = None
+
+    def data(self) -> dict:
+        if self._data is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    data = json.load(f)
+                self._data = data if isinstance(data, dict) else {}
+            except (OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    def save(self):
+        """Write the store to disk; failures are ignored (the cache stays in memory)."""
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._data or {}, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
@@ -0,0 +1,259 @@
+"""Harvest structured data (JSON-LD, microdata, OpenGraph) as direct field mappings.
+
+The compressor strips <script> and <meta> before the LLM sees the page, yet
+these often already carry title, price, date posted, address and company.
+Fields found here are mapped without any LLM call.
+
+A mapping is either a plain XPath string (microdata, OpenGraph) or, for
+JSON-LD, {"xpath": "//script[@type='application/ld+json']", "jsonpath": ...}
+where jsonpath is the subset  $[?(@type=='Type')].key.key  (filter optional).
+Only validate() understands jsonpath; the UI and evaluation scripts evaluate
+"xpath" alone and would read the whole JSON-LD blob, so JSON-LD mappings are
+returned only when the caller opts in (match_wantlist(..., jsonld=True)).
+"""
+
+import json
+import re
+from lxml.html import fromstring
+
+from genie import xpath_cache
+
+JSONLD_XPATH = "//script[@type='application/ld+json']"
+
+# Wantlist field → structured keys that satisfy it, in priority order.
+# Keys are snake_case property paths (e.g. hiringOrganization.name → hiring_organization_name)
+# or OpenGraph properties with ':' replaced by '_'.
+FIELD_ALIASES = {
+    "title": ["title", "headline", "og_title", "name"],
+    "title_original": ["title", "headline", "og_title"],
+    "name": ["name", "og_title"],
+    "description": ["description", "og_description"],
+    "detail": ["description"],
+    "price": ["price", "offers_price", "base_salary_value_value", "base_salary_value_min_value",
+              "base_salary_value", "product_price_amount", "og_price_amount"],
+    "date_posted": ["date_posted", "date_published", "article_published_time"],
+    "company": ["hiring_organization_name", "organization_name", "brand_name", "manufacturer_name",
+                "og_site_name"],
+    "facility_name": ["hiring_organization_name", "organization_name"],
+    "address": ["address_street_address", "job_location_address_street_address", "street_address",
+                "address"],
+    "prefecture": ["job_location_address_address_region", "address_address_region", "address_region"],
+    "city": ["job_location_address_address_locality", "address_address_locality", "address_locality"],
+    "contract": ["employment_type"],
+    "occupation": ["occupational_category"],
+    "working_hours": ["work_hours"],
+    "phone": ["telephone"],
+    "image": ["image", "og_image"],
+    "url": ["url", "og_url"],
+}
+
+_TYPE_FILTER = re.compile(r"^\$\[\?\(@type=='([^']+)'\)\]")
+
+
+def _snake(name: str) -> str:
+    """camelCase / og:prop → snake_case key."""
+    name = name.replace(":", "_").replace("-", "_")
+    return re.sub(r"(?<=[a-z0-9])(?=[A-Z])", "_", name).lower()
+
+
+def xpath_literal(value: str) -> str:
+    """Quote a string for use inside an XPath expression."""
+    if "'" not in value:
+        return f"'{value}'"
+    if '"' not in value:
+        return f'"{value}"'
+    parts = value.split("'")
+    return "concat(" + ", \"'\", ".join(f"'{p}'" for p in parts) + ")"
+
+
+def _load_jsonld(text: str) -> list:
+    """Parse one JSON-LD block into a list of top-level objects (@graph flattened)."""
+    text = (text or "").strip()
+    if text.startswith("<!--"):
+        text = text[4:]
+    if text.endswith("-->"):
+        text = text[:-3]
+    try:
+        data = json.loads(text)
+    except (ValueError, TypeError):
+        return []
+    items = data if isinstance(data, list) else [data]
+    objects = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        if isinstance(item.get("@graph"), list):
+            objects.extend(o for o in item["@graph"] if isinstance(o, dict))
+        else:
+            objects.append(item)
+    return objects
+
+
+def _object_type(obj: dict) -> str:
+    t = obj.get("@type")
+    if isinstance(t, list):
+        t = t[0] if t else ""
+    return t if isinstance(t, str) else ""
+
+
+def _scalar(value):
+    if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        text = str(value).strip()
+        return text or None
+    return None
+
+
+def _flatten_jsonld(obj: dict, path: list, out: dict, depth: int = 0):
+    """Collect {key_path_tuple: value} for scalar leaves (lists: first element)."""
+    if depth > 5:
+        return
+    for key, value in obj.items():
+        if key.startswith("@"):
+            continue
+        if isinstance(value, list):
+            value = value[0] if value else None
+        if isinstance(value, dict):
+            _flatten_jsonld(value, path + [key], out, depth + 1)
+        else:
+            v = _scalar(value)
+            if v is not None:
+                out.setdefault(tuple(path + [key]), v)
+
+
+def extract_json_values(nodes: list, jsonpath: str) -> list:
+    """Apply a jsonpath (see module docstring) to JSON-LD <script> nodes; return string values."""
+    m = _TYPE_FILTER.match(jsonpath)
+    type_name = m.group(1) if m else None
+    rest = jsonpath[m.end():] if m else jsonpath[1:]
+    keys = [k for k in rest.split(".") if k]
+
+    values = []
+    for node in nodes:
+        text = node if isinstance(node, str) else getattr(node, "text", None)
+        for obj in _load_jsonld(text):
+            if type_name and _object_type(obj) != type_name:
+                continue
+            current = [obj]
+            for key in keys:
+                nxt = []
+                for c in current:
+                    if isinstance(c, dict) and key in c:
+                        v = c[key]
+                        nxt.extend(v if isinstance(v, list) else [v])
+                current = nxt
+            for c in current:
+                v = _scalar(c)
+                if v is not None:
+                    values.append(v)
+    return values
+
+
+def _harvest_jsonld(doc, found: dict):
+    for script in xpath_cache.evaluate(doc, JSONLD_XPATH):
+        for obj in _load_jsonld(script.text):
+            type_name = _object_type(obj)
+            leaves = {}
+            _flatten_jsonld(obj, [], leaves)
+            for path, value in leaves.items():
+                key = "_".join(_snake(p) for p in path)
+                prefix = f"$[?(@type=='{type_name}')]" if type_name else "$"
+                mapping = {"xpath": JSONLD_XPATH, "jsonpath": prefix + "." + ".".join(path)}
+                found.setdefault(key, (mapping, value))
+
+
+def _harvest_microdata(doc, found: dict):
+    for el in xpath_cache.evaluate(doc, "//*[@itemprop]"):
+        prop = (el.get("itemprop") or "").split()
+        if not prop or el.get("itemscope") is not None:
+            continue
+        prop = prop[0]
+        # Qualify by the enclosing itemprop scope (e.g. address → address_street_address)
+        parent_prop = None
+        for anc in el.iterancestors():
+            if anc.get("itemscope") is not None:
+                parent_prop = (anc.get("itemprop") or "").split()
+                parent_prop = parent_prop[0] if parent_prop else None
+                break
+        key = _snake(prop) if not parent_prop else f"{_snake(parent_prop)}_{_snake(prop)}"
+        tag = el.tag if el.tag in ("meta", "link") else "*"
+        xpath = f"//{tag}[@itemprop={xpath_literal(prop)}]"
+        if parent_prop:
+            xpath = f"//*[@itemprop={xpath_literal(parent_prop)}]" + xpath
+        if el.tag == "meta":
+            xpath += "/@content"
+            value = el.get("content")
+        elif el.tag == "link":
+            xpath += "/@href"
+            value = el.get("href")
+        else:
+            value = el.text_content()
+        value = (value or "").strip()
+        if value:
+            found.setdefault(key, (xpath, value))
+
+
+def _harvest_opengraph(doc, found: dict):
+    for el in xpath_cache.evaluate(doc, "//meta[@property and @content]"):
+        prop = el.get("property").strip()
+        if not re.match(r"^(og|product|article|job):", prop):
+            continue
+        value = (el.get("content") or "").strip()
+        if value:
+            found.setdefault(_snake(prop), (f"//meta[@property={xpath_literal(prop)}]/@content", value))
+
+
+def harvest(html: str, jsonld: bool = True) -> dict:
+    """Extract structured-data candidates from one page.
+
+    Returns {key: (mapping, sample_value)}; microdata and OpenGraph win over
+    JSON-LD for the same key because their plain XPaths work everywhere.
+    jsonld=False leaves out JSON-LD candidates.
+    """
+    if not html or not re.search(r"ld\+json|itemprop|property=[\"'](?:og|product|article|job):", html):
+        return {}
+    try:
+        doc = fromstring(html)
+    except Exception:
+        try:
+            doc = fromstring(html.encode("utf-8"))
+        except Exception:
+            return {}
+    found = {}
+    _harvest_microdata(doc, found)
+    _harvest_opengraph(doc, found)
+    if jsonld:
+        _harvest_jsonld(doc, found)
+    return found
+
+
+def match_wantlist(pages: list, wantlist: dict, jsonld: bool = False) -> dict:
+    """Map wantlist fields to structured-data mappings present on every page.
+
+    Args:
+        pages: [{url, html, error}, ...]
+        wantlist: {field: description}
+        jsonld: also return {"xpath", "jsonpath"} JSON-LD mappings (the caller
+            must apply extract_json_values); otherwise those fields are left
+            to labels / the LLM, which return element XPaths
+
+    Returns:
+        {field: mapping} for the fields that need no LLM call.
+    """
+    harvested = [harvest(p["html"], jsonld) for p in pages if p.get("html")]
+    if not harvested or not all(harvested):
+        return {}
+
+    # Keys whose mapping is identical on every page
+    common = {}
+    for key, (mapping, _) in harvested[0].items():
+        if all(h.get(key, (None,))[0] == mapping for h in harvested[1:]):
+            common[key] = mapping
+
+    result = {}
+    for field in wantlist:
+        name = _snake(str(field))
+        for key in [name] + FIELD_ALIASES.get(name, []):
+            if key in common:
+                result[field] = common[key]
+                break
+    return result
@@ -0,0 +1,103 @@
+"""Learned label-synonym store (wantlist field → page label text).
+
+Every validated Want List mapping with confidence 1.0 whose XPath is anchored
+on a label (//dt[normalize-space()='給与']..., //th[...]) is a sighting of
+that label meaning that field. The label mapper consults the store before
+the LLM, so repeat verticals resolve known fields with no tokens.
+
+The store is shared by every caller, while want list descriptions (which
+steer the LLM) are caller-written. A pair is therefore only used once it
+has been seen on MIN_SITES distinct sites, and never for a label the
+built-in SYNONYMS assign to another field; learned labels rank after the
+built-in ones.
+
+Persisted as JSON; labels are keyed by normalize_label() (NFKC, so full-width
+and half-width forms share one entry).
+"""
+
+import os
+import re
+
+from genie.labels import SYNONYMS, normalize_label
+from genie.store import CACHE_DIR, CACHE_ENABLED, JsonStore
+
+STORE_PATH = os.environ.get("XPATHGENIE_SYNONYMS_PATH", os.path.join(CACHE_DIR, "synonyms.json"))
+MAX_LABELS_PER_FIELD = 50
+MIN_SITES = int(os.environ.get("XPATHGENIE_SYNONYM_MIN_SITES", 3))  # distinct sites before a pair is used
+
+# Label anchor inside a generated XPath: //dt[normalize-space()='給与'] / //th[...]
+_LABEL_ANCHOR = re.compile(r"(?:dt|th)\[normalize-space\(\)\s*=\s*(['\"])(.+?)\1\]")
+
+# {field: {normalized_label: {"label": str, "count": int, "sites": [site, ...] (up to MIN_SITES)}}}
+_store = JsonStore(STORE_PATH)
+
+
+def extract_label(xpath: str):
+    """Return the label text an XPath is anchored on, or None."""
+    m = _LABEL_ANCHOR.search(xpath or "")
+    return m.group(2) if m else None
+
+
+def learn(wantlist: dict, validated: dict, site: str) -> int:
+    """Record (field → label) sightings from validated mappings with confidence 1.0.
+
+    Args:
+        wantlist: the requested {field: description}
+        validated: validate() output
+        site: the pages' host; a pair counts once per distinct site
+
+    Returns:
+        Number of pairs recorded.
+    """
+    if not CACHE_ENABLED:
+        return 0
+    pairs = []
+    for field, info in validated.items():
+        if field not in wantlist or not isinstance(info, dict) or info.get("confidence") != 1.0:
+            continue
+        label = extract_label(info.get("xpath"))
+        if label and normalize_label(label):
+            pairs.append((field, label))
+    if not pairs:
+        return 0
+
+    with _store.lock:
+        store = _store.data()
+        for field, label in pairs:
+            labels = store.setdefault(field, {})
+            key = normalize_label(label)
+            entry = labels.setdefault(key, {"label": label, "count": 0})
+            entry["count"] += 1
+            sites = entry.setdefault("sites", [])
+            if site not in sites and len(sites) < MIN_SITES:
+                sites.append(site)
+            if len(labels) > MAX_LABELS_PER_FIELD:
+                weakest = min((k for k in labels if k != key), key=lambda k: labels[k]["count"])
+                del labels[weakest]
+        _store.save()
+    return len(pairs)
+
+
+def synonym_table(learned: bool = True) -> dict:
+    """Built-in SYNONYMS extended with learned labels (most frequently confirmed first).
+
+    Only labels seen on MIN_SITES distinct sites are added, after the built-in
+    ones, and not when the built-in table assigns the label to another field.
+    learned=False (or XPATHGENIE_NO_CACHE=1) returns the built-in table only.
+    """
+    if not learned or not CACHE_ENABLED:
+        return {field: list(labels) for field, labels in SYNONYMS.items()}
+    builtin_owner = {normalize_label(label): field for field, labels in SYNONYMS.items() for label in labels}
+    with _store.lock:
+        store = _store.data()
+        learned = {
+            field: [
+                e["label"] for key, e in sorted(labels.items(), key=lambda kv: -kv[1]["count"])
+                if len(e.get("sites", [])) >= MIN_SITES and builtin_owner.get(key, field) == field
+            ]
+            for field, labels in store.items()
+        }
+    table = {field: list(labels) for field, labels in SYNONYMS.items()}
+    for field, labels in learned.items():
+        table.setdefault(field, []).extend(labels)
+    return table
@@ -0,0 +1,257 @@
+"""XPath synthesis from example values — programming by example (AI cost: 0).
+
+Analysts often know one or two correct values per field (the SWDE
+groundtruth files list them for every page). synthesize() indexes the text
+of every element on the parsed pages, finds the nodes holding the example
+values and generalizes one XPath per field that works across pages:
+
+1. label anchors       //dt[normalize-space()='給与']/following-sibling::dd[1]
+2. class / id anchors  //span[contains(@class,'job_title')]
+3. positional fallback /html/body/div[2]/table/tr[3]/td[2]
+
+Candidates are scored on every page — example values reproduced, then pages
+with exactly one match, then anchor kind, then length — and the winners go
+straight into validate().
+"""
+
+import re
+import unicodedata
+from copy import deepcopy
+
+from lxml.html import tostring
+
+from genie import xpath_cache
+from genie.labels import MAX_LABEL_LEN, PAIR_TAGS, normalize_space
+from genie.structured import xpath_literal
+
+MAX_VALUE_CHARS = 300  # longer element texts are not indexed
+ANCESTOR_DEPTH = 3  # ancestors tried as class/id anchors
+# Label/value layouts; td/td covers two-column tables without th
+LABEL_PAIRS = PAIR_TAGS + (("td", "td"),)
+
+LABEL, CLASS, POSITION = 2, 1, 0  # anchor kinds, most robust first
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """NFKC with whitespace collapsed, for matching example values against node text."""
+    return _WS.sub(" ", unicodedata.normalize("NFKC", text or "")).strip()
+
+
+def build_index(docs: list) -> list:
+    """Per parsed page, {normalized text: [elements]} for elements with short text."""
+    index = []
+    for _, doc in docs:
+        by_text = {}
+        for el in doc.iter():
+            if not isinstance(el.tag, str):
+                continue
+            raw = el.text_content()
+            if len(raw) > 4 * MAX_VALUE_CHARS:  # cheap pre-check; whitespace collapses a lot
+                continue
+            text = normalize_text(raw)
+            if text and len(text) <= MAX_VALUE_CHARS:
+                by_text.setdefault(text, []).append(el)
+        index.append(by_text)
+    return index
+
+
+def _holds(text: str, value: str) -> bool:
+    """True if node text is the value, or the value plus a little decoration ("(1994)", "Map")."""
+    return text == value or (value in text and len(text) <= 2 * len(value) + 20)
+
+
+def _find(by_text: dict, value: str) -> list:
+    """Elements whose text is value; failing that, the smallest ones containing it."""
+    if value in by_text:
+        return by_text[value]
+    containing = [(len(text), els) for text, els in by_text.items() if _holds(text, value)]
+    if not containing:
+        return []
+    return min(containing, key=lambda c: c[0])[1]
+
+
+def _clean_tokens(value: str) -> list:
+    """Class/id tokens without digits (generated ids and per-item classes vary by page)."""
+    return [t for t in (value or "").split() if not any(ch.isdigit() for ch in t)]
+
+
+def _label_candidates(el) -> list:
+    candidates = []
+    node = el
+    for _ in range(ANCESTOR_DEPTH):
+        if node is None:
+            break
+        label_el = node.getprevious()
+        while label_el is not None and not isinstance(label_el.tag, str):
+            label_el = label_el.getprevious()
+        if label_el is not None and (label_el.tag, node.tag) in LABEL_PAIRS:
+            # The literal is compared by XPath normalize-space(), so no NFKC here
+            label = normalize_space(label_el.text_content())
+            if label and len(label) <= MAX_LABEL_LEN:
+                candidates.append(f"//{label_el.tag}[normalize-space()={xpath_literal(label)}]"
+                                  f"/following-sibling::{node.tag}[1]")
+        node = node.getparent()
+    return candidates
+
+
+def _anchor_steps(el) -> list:
+    steps = [f"{el.tag}[contains(@class,{xpath_literal(c)})]" for c in _clean_tokens(el.get("class"))]
+    steps += [f"{el.tag}[@id={xpath_literal(i)}]" for i in _clean_tokens(el.get("id"))]
+    return steps
+
+
+def _class_candidates(el) -> list:
+    candidates = [f"//{step}" for step in _anchor_steps(el)]
+    for ancestor in list(el.iterancestors())[:ANCESTOR_DEPTH]:
+        candidates += [f"//{step}//{el.tag}" for step in _anchor_steps(ancestor)]
+    return candidates
+
+
+def _score(xpath: str, kind: int, docs: list, examples: list) -> tuple:
+    """(examples reproduced by the first match, pages with one match, -surplus matches, kind, -length)."""
+    reproduced = single = surplus = 0
+    for i, (_, doc) in enumerate(docs):
+        try:
+            nodes = xpath_cache.evaluate(doc, xpath)
+        except Exception:
+            return None
+        nodes = [n for n in nodes if hasattr(n, "text_content")]
+        if len(nodes) == 1:
+            single += 1
+        surplus += max(len(nodes) - 1, 0)
+        if nodes:
+            first = normalize_text(nodes[0].text_content())
+            reproduced += sum(1 for page, value in examples if page == i and _holds(first, value))
+    return reproduced, single, -surplus, kind, -len(xpath)
+
+
+def synthesize(examples: dict, docs: list, index: list = None) -> dict:
+    """Generalize one XPath per field from example values.
+
+    Args:
+        examples: {field: value or [values]} — known values from any of the pages
+        docs: parse_pages() output
+        index: build_index(docs), if already built
+
+    Returns:
+        {field: xpath} for fields whose examples were found on some page.
+    """
+    index = build_index(docs) if index is None else index
+    mappings = {}
+    for field, values in examples.items():
+        values = [values] if isinstance(values, str) else values
+        values = [normalize_text(v) for v in values if isinstance(v, str) and normalize_text(v)]
+        found = []  # (page, value, element)
+        for i, by_text in enumerate(index):
+            for value in values:
+                found += [(i, value, el) for el in _find(by_text, value)]
+        if not found:
+            continue
+
+        candidates = {}
+        for i, _, el in found:
+            tree = docs[i][1].getroottree()
+            for xpath in _label_candidates(el):
+                candidates.setdefault(xpath, LABEL)
+            for xpath in _class_candidates(el):
+                candidates.setdefault(xpath, CLASS)
+            candidates.setdefault(tree.getpath(el), POSITION)
+
+        hits = sorted({(i, value) for i, value, _ in found})
+        best = None
+        for xpath, kind in candidates.items():
+            score = _score(xpath, kind, docs, hits)
+            if score is not None and score[0] > 0 and (best is None or score > best[0]):
+                best = (score, xpath)
+        if best:
+            mappings[field] = best[1]
+    return mappings
+
+
+def _relative_steps(ancestor, el) -> str:
+    """Child steps from ancestor down to el, indexed only where a tag repeats among siblings."""
+    steps = []
+    node = el
+    while node is not ancestor:
+        parent = node.getparent()
+        same = [c for c in parent if c.tag == node.tag]
+        steps.append(node.tag if len(same) == 1 else f"{node.tag}[{same.index(node) + 1}]")
+        node = parent
+    return "/".join(reversed(steps))
+
+
+def resolve_target(xpath: str, doc):
+    """The element a browser-generated absolute XPath points at, or None.
+
+    Browsers insert <tbody> that lxml does not, so a path with tbody steps
+    is retried without them.
+    """
+    for candidate in (xpath, xpath.replace("/tbody", "")):
+        try:
+            nodes = [n for n in xpath_cache.evaluate(doc, candidate) if isinstance(getattr(n, "tag", None), str)]
+        except Exception:
+            continue
+        if nodes:
+            return nodes[0]
+    return None
+
+
+def generalize(el, docs: list) -> dict:
+    """Shortest label- or class-anchored XPath selecting exactly el on docs[0].
+
+    Candidates must select el and nothing else on the clicked page; among
+    those, the one matching exactly one node on the most sibling pages wins,
+    then anchor kind, then length (ties broken alphabetically, so the result
+    is deterministic).
+
+    Returns:
+        {"xpath", "kind": "label" | "class", "holds_on": sibling pages with
+        exactly one match} or None when no anchored XPath is unique.
+    """
+    doc = docs[0][1]
+    candidates = {}
+    for xpath in _label_candidates(el):
+        candidates.setdefault(xpath, LABEL)
+    for xpath in _class_candidates(el):
+        candidates.setdefault(xpath, CLASS)
+    for ancestor in list(el.iterancestors())[:ANCESTOR_DEPTH + 2]:
+        for step in _anchor_steps(ancestor):
+            candidates.setdefault(f"//{step}/{_relative_steps(ancestor, el)}", CLASS)
+
+    best = None
+    for xpath, kind in candidates.items():
+        try:
+            if xpath_cache.evaluate(doc, xpath) != [el]:
+                continue
+            holds_on = sum(1 for _, sibling in docs[1:] if len(xpath_cache.evaluate(sibling, xpath)) == 1)
+        except Exception:
+            continue
+        key = (-holds_on, -kind, len(xpath), xpath)
+        if best is None or key < best[0]:
+            best = (key, {"xpath": xpath, "kind": "label" if kind == LABEL else "class", "holds_on": holds_on})
+    return best[1] if best else None
+
+
+def marked_context(el, levels: int = 3, max_chars: int = 4000) -> str:
+    """HTML around el (levels ancestors up) with el marked data-xpg-target="1", for the LLM fallback.
+
+    Works on a copy, so shared (cached) trees are left untouched.
+    """
+    top = el
+    for _ in range(levels):
+        if top.getparent() is None:
+            break
+        top = top.getparent()
+    path = []
+    node = el
+    while node is not top:
+        path.append(node.getparent().index(node))
+        node = node.getparent()
+    copy = deepcopy(top)
+    target = copy
+    for i in reversed(path):
+        target = target[i]
+    target.set("data-xpg-target", "1")
+    return tostring(copy, encoding="unicode", with_tail=False)[:max_chars]
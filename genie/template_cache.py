@@ -0,0 +1,77 @@
+"""Site-template mapping cache: skip the LLM for templates mapped before.
+
+Entries are keyed by (site, structural fingerprint, wantlist hash, model).
+On a hit the stored mappings are re-validated against the new pages and
+returned without any LLM call, unless validation confidence dropped.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from genie.store import CACHE_DIR, CACHE_ENABLED, JsonStore
+
+STORE_PATH = os.environ.get("XPATHGENIE_TEMPLATE_CACHE_PATH", os.path.join(CACHE_DIR, "templates.json"))
+MAX_ENTRIES = 1000
+
+# {key: {"mappings": {field: xpath | {xpath, jsonpath}}, "confidence": {field: float}, "used": ts}}
+_store = JsonStore(STORE_PATH)
+
+
+def template_key(site: str, fingerprint: str, wantlist: dict, model: str, jsonld: bool = False) -> str:
+    """Cache key for a page template + requested schema + model (+ JSON-LD opt-in)."""
+    wl = json.dumps(wantlist, sort_keys=True, ensure_ascii=False) if wantlist else "discover"
+    wl_hash = hashlib.sha1(wl.encode("utf-8")).hexdigest()[:16]
+    raw = f"{site}|{fingerprint}|{wl_hash}|{model}" + ("|jsonld" if jsonld else "")
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def mappings_of(validated: dict) -> dict:
+    """Turn validate() output back into mappings (keeping JSON-LD jsonpaths)."""
+    return {
+        field: {"xpath": info["xpath"], "jsonpath": info["jsonpath"]} if info.get("jsonpath") else info["xpath"]
+        for field, info in validated.items()
+    }
+
+
+def lookup(key: str):
+    """Return the cached entry for key, or None."""
+    if not CACHE_ENABLED:
+        return None
+    with _store.lock:
+        entry = _store.data().get(key)
+        if entry:
+            entry["used"] = time.time()
+        return entry
+
+
+def store(key: str, validated: dict):
+    """Cache the fields of validated that matched on at least one page."""
+    hit = {field: info for field, info in validated.items() if info.get("confidence", 0) > 0}
+    if not hit or not CACHE_ENABLED:
+        return
+    with _store.lock:
+        data = _store.data()
+        data[key] = {
+            "mappings": mappings_of(hit),
+            "confidence": {field: info["confidence"] for field, info in hit.items()},
+            "used": time.time(),
+        }
+        if len(data) > MAX_ENTRIES:
+            for old in sorted(data, key=lambda k: data[k].get("used", 0))[:len(data) - MAX_ENTRIES]:
+                del data[old]
+        _store.save()
+
+
+def still_valid(entry: dict, validated: dict) -> bool:
+    """True if re-validation held up: fields at 1.0 still are, and mean confidence did not drop."""
+    before = entry.get("confidence", {})
+    if not before or not validated:
+        return False
+    for field, conf in before.items():
+        if conf >= 1.0 and validated.get(field, {}).get("confidence", 0) < 1.0:
+            return False
+    mean_before = sum(before.values()) / len(before)
+    mean_after = sum(validated.get(f, {}).get("confidence", 0) for f in before) / len(before)
+    return mean_after >= mean_before
@@ -4,6 +4,9 @@ import re
 from lxml import etree
 from lxml.html import fromstring
 
+from genie import xpath_cache
+from genie.structured import extract_json_values
+
 # Tags/classes that indicate main content vs sidebar
 MAIN_SIGNALS = {'main', 'article', 'detail', 'content', 'primary', 'job-detail', 'recruit-detail'}
 SIDE_SIGNALS = {'aside', 'sidebar', 'recommend', 'related', 'sub', 'widget', 'footer', 'nav'}
@@ -55,13 +58,14 @@ def find_multi_matches(mappings: dict, pages: list) -> dict:
         except Exception:
             pass
 
+    containers = {}
     multi = {}
     for field, xpath in mappings.items():
         field_contexts = []
         all_vals_across_pages = set()  # Track unique values across ALL pages
         for url, doc in docs:
             try:
-                nodes = doc.xpath(xpath)
+                nodes = select(doc, xpath, containers)
                 if len(nodes) > 1:
                     # Collect values from this page
                     for node in nodes:
@@ -135,7 +139,7 @@ def narrow_by_first_match(mappings: dict, multi_matches: dict, pages: list) -> d
         elem_xpath = xpath.rsplit("/@", 1)[0] if "/@" in xpath else xpath
 
         try:
-            elems = doc.xpath(elem_xpath)
+            elems = xpath_cache.evaluate(doc, elem_xpath)
         except Exception:
             continue
         if len(elems) < 2:
@@ -160,7 +164,7 @@ def narrow_by_first_match(mappings: dict, multi_matches: dict, pages: list) -> d
                         continue
                     candidate = f"//{container_part}//{anc.tag}[contains(@class,'{c}')]{core_part}"
                     try:
-                        test_nodes = doc.xpath(candidate)
+                        test_nodes = xpath_cache.evaluate(doc, candidate)
                         if len(test_nodes) == 1:
                             narrowed[field] = candidate
                             found = True
@@ -175,81 +179,166 @@ def narrow_by_first_match(mappings: dict, multi_matches: dict, pages: list) -> d
     return narrowed
 
 
-def validate(mappings: dict, pages: list) -> dict:
+# Axes that can leave a container's subtree; cores using them are not split
+_ESCAPING_AXES = re.compile(r"\.\.|ancestor|parent::|(?<!-)following::|(?<!-)preceding::")
+# As the core's first step these also apply to the container itself (its siblings)
+_ESCAPING_FIRST_STEP = re.compile(r"\s*(following-sibling|preceding-sibling|self)\s*::")
+
+
+def split_container(xpath: str):
+    """("//container", "core") for a container-prefixed "//container//core", else None.
+
+    Only cores that stay inside the container (no parent/ancestor/following/
+    preceding axes, no leading sibling/self step, no top-level union) are split, so evaluating the core
+    under each container yields exactly the nodes of the full expression.
     """
-    Validate XPath mappings against HTML pages.
-    
-    Args:
-        mappings: {field_name: xpath_expression}
-        pages: [{url, html, error}, ...]
-    
-    Returns:
-        {field_name: {xpath, confidence, samples, optional}}
+    if not isinstance(xpath, str) or not xpath.startswith("//") or _ESCAPING_AXES.search(xpath):
+        return None
+    depth = 0
+    quote = None
+    split = None
+    for i in range(2, len(xpath)):
+        ch = xpath[i]
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif ch in "[(":
+            depth += 1
+        elif ch in "])":
+            depth -= 1
+        elif depth == 0 and ch == "|":
+            return None
+        elif depth == 0 and ch == "/" and split is None:
+            if not xpath.startswith("//", i):
+                return None
+            split = i
+    if split is None or split == 2 or len(xpath) <= split + 2 or _ESCAPING_FIRST_STEP.match(xpath, split + 2):
+        return None
+    return xpath[:split], xpath[split + 2:]
+
+
+def select(doc, xpath: str, containers: dict = None) -> list:
+    """doc.xpath(xpath) through genie.xpath_cache, evaluating a container prefix once per doc.
+
+    containers is a cache shared by the calls validating one set of docs
+    ({} to start). The core of a "//container//core" XPath is then evaluated
+    under the cached container nodes only, so the cost follows the container
+    size instead of re-scanning the document for every field. Nested or
+    non-element containers fall back to the full expression.
     """
-    valid_pages = [p for p in pages if p.get("html")]
-    total = len(valid_pages)
-    if total == 0:
-        return {}
+    split = split_container(xpath) if containers is not None else None
+    if split is None:
+        return xpath_cache.evaluate(doc, xpath)
+    prefix, core = split
+    key = (id(doc), prefix)
+    entry = containers.get(key)
+    if entry is None or entry[0] is not doc:
+        found = xpath_cache.evaluate(doc, prefix)
+        nodes = [n for n in found if isinstance(getattr(n, "tag", None), str)]
+        members = set(nodes)
+        nested = any(a in members for n in nodes for a in n.iterancestors())
+        # Disjoint subtrees keep per-container results in document order
+        entry = (doc, None if nested or len(nodes) != len(found) else nodes)
+        containers[key] = entry
+    if entry[1] is None:
+        return xpath_cache.evaluate(doc, xpath)
+    find = xpath_cache.compiled(".//" + core)
+    result = []
+    for container in entry[1]:
+        result.extend(find(container))
+    return result
+
 
-    # Parse all pages
+def parse_pages(pages: list) -> list:
+    """Parse fetched pages once for repeated validation: [(url, doc), ...]."""
     docs = []
-    for p in valid_pages:
+    for p in pages:
+        if not p.get("html"):
+            continue
         try:
-            doc = fromstring(p["html"])
-            docs.append((p["url"], doc))
+            docs.append((p["url"], fromstring(p["html"])))
         except Exception:
             pass
+    return docs
 
-    total = len(docs)
-    if total == 0:
-        return {}
 
-    results = {}
-    for field, xpath in mappings.items():
-        hits = 0
-        samples = []
-        multi_hits = []
-        for url, doc in docs:
-            try:
-                nodes = doc.xpath(xpath)
-                if nodes:
-                    hits += 1
-                    # Pick the best match by structural content score
-                    best_val = ""
-                    best_score = -999
-                    for node in nodes:
-                        if isinstance(node, str):
-                            val = node.strip()
-                            sc = 0  # can't score text nodes
-                        elif hasattr(node, "text_content"):
-                            val = node.text_content().strip()
-                            sc = _content_score(node)
-                        else:
-                            val = str(node).strip()
-                            sc = 0
-                        if sc > best_score or (sc == best_score and len(val) > len(best_val)):
-                            best_val = val
-                            best_score = sc
-                    if best_val:
-                        samples.append(best_val[:100])
+def validate_field(xpath, docs: list, containers: dict = None) -> dict:
+    """Validate one mapping (XPath or {"xpath", "jsonpath"}) against parsed docs.
+
+    Pass the same containers dict (see select()) when validating several
+    fields against the same docs.
+    """
+    jsonpath = None
+    if isinstance(xpath, dict):
+        xpath, jsonpath = xpath["xpath"], xpath.get("jsonpath")
+    total = len(docs)
+    hits = 0
+    samples = []
+    multi_hits = []
+    for url, doc in docs:
+        try:
+            nodes = select(doc, xpath, containers)
+            if jsonpath:
+                nodes = extract_json_values(nodes, jsonpath)
+            if nodes:
+                hits += 1
+                # Pick the best match by structural content score
+                best_val = ""
+                best_score = -999
+                for node in nodes:
+                    if isinstance(node, str):
+                        val = node.strip()
+                        sc = 0  # can't score text nodes
+                    elif hasattr(node, "text_content"):
+                        val = node.text_content().strip()
+                        sc = _content_score(node)
                     else:
-                        samples.append("(empty)")
-                    if len(nodes) > 1:
-                        multi_hits.append(url)
+                        val = str(node).strip()
+                        sc = 0
+                    if sc > best_score or (sc == best_score and len(val) > len(best_val)):
+                        best_val = val
+                        best_score = sc
+                if best_val:
+                    samples.append(best_val[:100])
                 else:
-                    samples.append(None)
-            except Exception as e:
-                samples.append(f"(error: {e})")
-
-        confidence = hits / total if total > 0 else 0
-        result_entry = {
-            "xpath": xpath,
-            "confidence": round(confidence, 2),
-            "samples": samples,
-            "optional": confidence < 1.0,
-        }
-        if multi_hits:
-            result_entry["warning"] = f"Multiple matches on {len(multi_hits)}/{total} pages — may include sidebar/recommended items"
-        results[field] = result_entry
-
-    return results
+                    samples.append("(empty)")
+                if len(nodes) > 1:
+                    multi_hits.append(url)
+            else:
+                samples.append(None)
+        except Exception as e:
+            samples.append(f"(error: {e})")
+
+    confidence = hits / total if total > 0 else 0
+    result_entry = {
+        "xpath": xpath,
+        "confidence": round(confidence, 2),
+        "samples": samples,
+        "optional": confidence < 1.0,
+    }
+    if jsonpath:
+        result_entry["jsonpath"] = jsonpath
+    if multi_hits:
+        result_entry["warning"] = f"Multiple matches on {len(multi_hits)}/{total} pages — may include sidebar/recommended items"
+    return result_entry
+
+
+def validate(mappings: dict, pages: list) -> dict:
+    """
+    Validate XPath mappings against HTML pages.
+    
+    Args:
+        mappings: {field_name: xpath_expression} — a value may also be
+            {"xpath", "jsonpath"} for JSON-LD fields (see genie.structured)
+        pages: [{url, html, error}, ...]
+    
+    Returns:
+        {field_name: {xpath, confidence, samples, optional}} (+ jsonpath if given)
+    """
+    docs = parse_pages(pages)
+    if not docs:
+        return {}
+    containers = {}
+    return {field: validate_field(xpath, docs, containers) for field, xpath in mappings.items()}
@@ -0,0 +1,69 @@
+"""Process-wide LRU of compiled XPath expressions.
+
+doc.xpath(string) compiles the expression on every call, while validation
+evaluates the same few dozen XPaths on every page of every request.
+compiled() keeps up to MAX_ENTRIES etree.XPath objects keyed by expression,
+shared by all threads (lxml serializes evaluations of one compiled object).
+Syntax errors are cached too (as type and args, raised as a fresh instance
+each time, so concurrent raises never share traceback or context), so a bad
+XPath fails without being recompiled. stats() is reported under "xpath_cache" in /api/metrics.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from lxml import etree
+
+MAX_ENTRIES = 1024
+
+_cache = OrderedDict()  # expression → etree.XPath, or (XPathError type, args) it raised
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "errors": 0, "compile_seconds": 0.0}
+
+
+def compiled(expression: str) -> etree.XPath:
+    """Compiled etree.XPath for expression; raises etree.XPathError (cached) if it does not compile."""
+    with _lock:
+        entry = _cache.get(expression)
+        if entry is not None:
+            _cache.move_to_end(expression)
+            _stats["hits"] += 1
+    if entry is None:
+        start = time.perf_counter()
+        try:
+            entry = etree.XPath(expression)
+        except etree.XPathError as e:
+            entry = (type(e), e.args)
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _stats["misses"] += 1
+            _stats["compile_seconds"] += elapsed
+            if isinstance(entry, tuple):
+                _stats["errors"] += 1
+            _cache[expression] = entry
+            _cache.move_to_end(expression)
+            while len(_cache) > MAX_ENTRIES:
+                _cache.popitem(last=False)
+    if isinstance(entry, tuple):
+        error_type, args = entry
+        raise error_type(*args)
+    return entry
+
+
+def evaluate(doc, expression: str) -> list:
+    """doc.xpath(expression) through the compiled cache."""
+    return compiled(expression)(doc)
+
+
+def stats() -> dict:
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            "entries": len(_cache),
+            "hits": _stats["hits"],
+            "misses": _stats["misses"],
+            "errors": _stats["errors"],
+            "hit_rate": round(_stats["hits"] / lookups, 3) if lookups else None,
+            "compile_ms": round(_stats["compile_seconds"] * 1000, 2),
+        }
@@ -15,6 +15,9 @@ Usage:
 import sys, json, time, re, os, requests
 from lxml import html as lxml_html
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from genie import xpath_cache
+
 API_BASE = "http://127.0.0.1:8789"
 RESULTS_DIR = os.path.join(os.path.dirname(__file__), "..", "docs", "evaluation", "results")
 URL_LISTS = os.path.join(os.path.dirname(__file__), "..", "docs", "evaluation", "url_lists.txt")
@@ -77,13 +80,16 @@ def load_urls(site_key):
     return urls
 
 
-def analyze(url, wantlist=None):
-    """Genie APIで1URLを分析"""
+def analyze(url, wantlist=None, run=None):
+    """Genie APIで1URLを分析(run: 実験の試行番号。カセット記録を試行ごとに分ける)"""
     print(f"[Genie] Analyzing: {url}")
     t0 = time.time()
-    payload = {"urls": [url]}
+    # cache: false — every run is a fresh LLM analysis (no template cache / learned synonyms / refine cache)
+    payload = {"urls": [url], "cache": False}
     if wantlist:
         payload["wantlist"] = wantlist
+    if run is not None:
+        payload["run"] = run
     resp = requests.post(f"{API_BASE}/api/analyze", json=payload, timeout=120)
     elapsed = time.time() - t0
     if resp.status_code != 200:
@@ -142,7 +148,7 @@ def fetch_html(url):
 def eval_xpath(xpath_str, doc):
     """lxmlでXPath評価"""
     try:
-        results = doc.xpath(xpath_str)
+        results = xpath_cache.evaluate(doc, xpath_str)
         values = []
         for r in results:
             if hasattr(r, "text_content"):
@@ -156,7 +162,7 @@ def eval_xpath(xpath_str, doc):
         return None
 
 
-def evaluate_site(site_key, mode="wantlist"):
+def evaluate_site(site_key, mode="wantlist", run=None):
     urls = load_urls(site_key)
     if not urls:
         print(f"[Error] No URLs found for {site_key}")
@@ -168,7 +174,7 @@ def evaluate_site(site_key, mode="wantlist"):
 
     # Step 1: Genie analysis (1st URL)
     wantlist = DEFAULT_WANTLIST if mode == "wantlist" else None
-    mappings, genie_time = analyze(urls[0], wantlist=wantlist)
+    mappings, genie_time = analyze(urls[0], wantlist=wantlist, run=run)
     if not mappings:
         print("[Error] Genie analysis failed")
         return
@@ -45,7 +45,7 @@ def main():
             print(f"{'='*50}")
             
             try:
-                result = evaluate_site(site, mode="wantlist")
+                result = evaluate_site(site, mode="wantlist", run=run)
                 if result:
                     # Save with run number
                     with open(out_path, "w") as f:
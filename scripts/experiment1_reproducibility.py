@@ -4,6 +4,10 @@
 各サイトのhit rateのmean±stdを計算する。
 
 結果は ~/tools/XPathGenie/docs/evaluation/reproducibility_report.md に保存。
+
+各試行は cache: false と試行番号 run を付けて /api/analyze を呼ぶ。サーバーで
+XPATHGENIE_CASSETTE を使う場合も試行ごとに別々に記録・再生されるため、
+3回の試行は独立したサンプルのまま(同一応答の再生でばらつきが0にならない)。
 """
 
 import os
@@ -74,7 +78,7 @@ def main():
             
             try:
                 # Call evaluate_site directly
-                summary = evaluate_site(site, mode="wantlist")
+                summary = evaluate_site(site, mode="wantlist", run=run)
                 total_runs += 1
                 
                 if summary and 'avg_hit_rate' in summary:
@@ -111,7 +111,7 @@ def main():
             
             try:
                 # Call evaluate_site directly
-                summary = evaluate_site(site, mode="wantlist")
+                summary = evaluate_site(site, mode="wantlist", run=run)
                 total_runs += 1
                 
                 if summary and 'avg_hit_rate' in summary:
@@ -7,6 +7,9 @@
 - w/o normalize-space (プロンプトのnormalize-space指示をtext()=に置換)
 
 結果は ~/tools/XPathGenie/docs/evaluation/ablation_report.md に保存。
+
+XPATHGENIE_CASSETTE=data/cassettes/ablation.jsonl.gz を指定するとLLM呼び出しを
+記録し、2回目以降は再生する(集計・レポートだけ変えた再実行はトークン消費ゼロ)。
 """
 
 import os
@@ -22,6 +25,9 @@ import requests
 # Add XPathGenie path for imports
 sys.path.insert(0, '/home/ec2-user/tools/XPathGenie')
 
+# 学習済みキャッシュ(テンプレート・同義語・refine)を使わず毎回新規に解析する
+os.environ.setdefault("XPATHGENIE_NO_CACHE", "1")
+
 # Import genie modules directly
 from genie.fetcher import fetch_all
 from genie.compressor import compress
@@ -35,7 +35,7 @@ def run_via_api(site_key, wantlist=None):
         return None
 
     # Step 1: Analyze via API (1st URL)
-    payload = {"urls": [urls[0]]}
+    payload = {"urls": [urls[0]], "cache": False}
     if wantlist:
         payload["wantlist"] = wantlist
     
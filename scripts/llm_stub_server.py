@@ -0,0 +1,329 @@
+#!/usr/bin/env python3 -u
+"""
+Gemini互換のローカルLLMスタブサーバー — オフライン負荷試験・ベンチマーク用
+
+Usage:
+  python3 -u scripts/llm_stub_server.py --port 8790 --latency 3.0 --per-token-ms 5
+  XPATHGENIE_LLM_BASE_URL=http://127.0.0.1:8790 python3 -u app.py
+
+- POST /v1beta/models/{model}:generateContent を実装（APIキーは無視）
+- POST /v1beta/models/{model}:streamGenerateContent?alt=sse はSSEで
+  --stream-chunk 文字ずつ返す（初回チャンクまで --latency、以降は出力トークン比例）
+- マッピングは --canned のJSONを返すか、プロンプト内のHTMLから
+  dt/dd・th/td ラベルを拾ってルール生成（genie.labels）
+- レイテンシ = --latency + 出力トークン数 × --per-token-ms (+ --jitter)
+- usageMetadata のトークン数は文字数/4 で概算（--prompt-tokens で固定可）
+- generationConfig.responseSchema があれば、そのキーだけを（欠けたものはnullで）返す
+- --degrade-model に一致するモデル名（例: lite）では1つおきのフィールドをnullにして
+  弱いモデルを模擬（カスケードの評価用）
+- POST /v1beta/cachedContents・PATCH /v1beta/cachedContents/{id}（TTL延長）で
+  コンテキストキャッシュを模擬。cachedContent 付きの呼び出しはキャッシュ分を
+  cachedContentTokenCount として返し、--per-prompt-token-ms は非キャッシュ分にのみ掛かる
+- 出力が maxOutputTokens（--max-output-tokens で上書き可）を超えると途中で切り、
+  finishReason=MAX_TOKENS を返す
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lxml.html import fromstring
+
+from genie.labels import SYNONYMS, find_label_pairs, match_labels, normalize_label
+
+PAGE_SPLIT = re.compile(r"\n--- Page \d+ ---\n")
+WANTLIST_BLOCK = re.compile(r"Requested fields \(JSON schema\):\n(.*?)\n\nRules:", re.S)
+REFINE_BLOCK = re.compile(r"Fields that need refinement:\n(.*)", re.S)
+
+CONFIG = {}
+STATS = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "caches_created": 0}
+CACHES = {}  # name → {"text", "model", "expires"}
+_stats_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _first_page(prompt: str):
+    parts = PAGE_SPLIT.split(prompt)
+    if len(parts) < 2:
+        return None
+    try:
+        return fromstring(parts[1].strip())
+    except Exception:
+        return None
+
+
+def generate_mappings(prompt: str) -> dict:
+    """Rule-based stand-in for the model: label XPaths from the first page."""
+    m = REFINE_BLOCK.search(prompt)
+    if m:
+        try:
+            fields = json.loads(m.group(1).strip())
+        except ValueError:
+            return {}
+        return {f: info.get("current_xpath") for f, info in fields.items()}
+
+    doc = _first_page(prompt)
+    pairs = find_label_pairs(doc) if doc is not None else {}
+
+    m = WANTLIST_BLOCK.search(prompt)
+    if m:
+        try:
+            wantlist = json.loads(m.group(1))
+        except ValueError:
+            wantlist = {}
+        found = match_labels(pairs, wantlist)
+        return {field: found.get(field) for field in wantlist}
+
+    # Discover mode: name labels through the synonym table, else field_N
+    by_label = {normalize_label(l): f for f, labels in SYNONYMS.items() for l in labels}
+    mappings = {}
+    for i, (label, xpath) in enumerate(pairs.items()):
+        field = by_label.get(normalize_label(label)) or f"field_{i + 1}"
+        mappings.setdefault(field, xpath)
+        if len(mappings) >= 20:
+            break
+    return mappings
+
+
+CONTINUE_BLOCK = re.compile(r"do NOT repeat them:\n(.*?)\nReturn ONLY", re.S)
+
+
+def build_response(prompt: str, generation_config: dict = None, model: str = "", cached_text: str = "") -> dict:
+    generation_config = generation_config or {}
+    if CONFIG.get("canned") is not None and not REFINE_BLOCK.search(prompt):
+        mappings = CONFIG["canned"]
+    else:
+        mappings = generate_mappings(prompt)
+    if CONFIG.get("degrade_model") and CONFIG["degrade_model"] in model:
+        mappings = {k: (v if i % 2 == 0 else None) for i, (k, v) in enumerate(mappings.items())}
+    schema = generation_config.get("responseSchema")
+    if schema and schema.get("properties"):
+        mappings = {k: mappings.get(k) for k in schema["properties"]}
+    m = CONTINUE_BLOCK.search(prompt)
+    if m:
+        try:
+            done = set(json.loads(m.group(1)))
+        except ValueError:
+            done = set()
+        mappings = {k: v for k, v in mappings.items() if k not in done}
+    text = json.dumps(mappings, ensure_ascii=False)
+    finish_reason = "STOP"
+    limit = CONFIG.get("max_output_tokens") or generation_config.get("maxOutputTokens")
+    if limit and estimate_tokens(text) > limit:
+        text = text[:limit * 4]
+        finish_reason = "MAX_TOKENS"
+    prompt_tokens = CONFIG.get("prompt_tokens") or estimate_tokens(prompt)
+    cached_tokens = min(prompt_tokens, estimate_tokens(cached_text)) if cached_text else 0
+    output_tokens = CONFIG.get("output_tokens") or estimate_tokens(text)
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": text}], "role": "model"},
+            "finishReason": finish_reason,
+        }],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+            **({"cachedContentTokenCount": cached_tokens} if cached_tokens else {}),
+        },
+        "modelVersion": "stub",
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        if CONFIG.get("verbose"):
+            super().log_message(fmt, *args)
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.startswith("/stats"):
+            with _stats_lock:
+                return self._send_json(200, dict(STATS))
+        self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+
+    def _send_sse(self, body: dict, delay_first: float, per_token: float):
+        """Stream body's text as SSE chunks (chunked transfer encoding)."""
+        text = body["candidates"][0]["content"]["parts"][0]["text"]
+        size = CONFIG["stream_chunk"]
+        pieces = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(delay_first)
+        for i, piece in enumerate(pieces):
+            chunk = {"candidates": [{"content": {"parts": [{"text": piece}], "role": "model"}}]}
+            if i == len(pieces) - 1:
+                chunk["candidates"][0]["finishReason"] = body["candidates"][0]["finishReason"]
+                chunk["usageMetadata"] = body["usageMetadata"]
+            event = f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n".encode("utf-8")
+            self.wfile.write(f"{len(event):X}\r\n".encode() + event + b"\r\n")
+            self.wfile.flush()
+            if i < len(pieces) - 1:
+                time.sleep(estimate_tokens(piece) * per_token)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"code": 400, "message": "Invalid JSON"}})
+            return None
+
+    @staticmethod
+    def _ttl(req: dict) -> float:
+        try:
+            return float(str(req.get("ttl", "3600s")).rstrip("s"))
+        except ValueError:
+            return 3600.0
+
+    def _create_cache(self, req: dict):
+        try:
+            text = "".join(p.get("text", "") for c in req.get("contents", []) for p in c.get("parts", []))
+        except AttributeError:
+            return self._send_json(400, {"error": {"code": 400, "message": "Invalid contents"}})
+        model = str(req.get("model", "")).split("/")[-1]
+        name = "cachedContents/" + hashlib.sha1(f"{model}|{text}|{time.time()}".encode("utf-8")).hexdigest()[:16]
+        expires = time.time() + self._ttl(req)
+        with _stats_lock:
+            CACHES[name] = {"text": text, "model": model, "expires": expires}
+            STATS["caches_created"] += 1
+        self._send_json(200, {
+            "name": name,
+            "model": f"models/{model}",
+            "expireTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(expires)),
+            "usageMetadata": {"totalTokenCount": estimate_tokens(text)},
+        })
+
+    def do_PATCH(self):
+        req = self._read_json()
+        if req is None:
+            return
+        name = self.path.split("?")[0][len("/v1beta/"):]
+        with _stats_lock:
+            cache = CACHES.get(name)
+            if cache and cache["expires"] > time.time():
+                cache["expires"] = time.time() + self._ttl(req)
+        if not cache:
+            return self._send_json(404, {"error": {"code": 404, "message": f"{name} not found"}})
+        self._send_json(200, {"name": name})
+
+    def do_POST(self):
+        req = self._read_json()
+        if req is None:
+            return
+        if self.path.startswith("/v1beta/cachedContents"):
+            return self._create_cache(req)
+        m = re.match(r"^/v1beta/models/([^/:]+):(generateContent|streamGenerateContent)", self.path)
+        if not m:
+            return self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+        if CONFIG.get("error_rate") and random.random() < CONFIG["error_rate"]:
+            headers = {"Retry-After": str(CONFIG["retry_after"])} if CONFIG.get("retry_after") is not None else None
+            return self._send_json(503, {"error": {"code": 503, "message": "Stub overloaded"}}, headers)
+
+        try:
+            prompt = "".join(p.get("text", "") for c in req.get("contents", []) for p in c.get("parts", []))
+        except AttributeError:
+            return self._send_json(400, {"error": {"code": 400, "message": "Invalid contents"}})
+        cached_text = ""
+        if req.get("cachedContent"):
+            with _stats_lock:
+                cache = CACHES.get(req["cachedContent"])
+            if not cache or cache["expires"] <= time.time():
+                return self._send_json(404, {"error": {"code": 404, "message": "CachedContent not found"}})
+            if cache["model"] != m.group(1):
+                return self._send_json(400, {"error": {"code": 400, "message": "Model does not match cache"}})
+            cached_text = cache["text"]
+        body = build_response(cached_text + prompt, req.get("generationConfig"), m.group(1), cached_text)
+        usage = body["usageMetadata"]
+        cached_tokens = usage.get("cachedContentTokenCount", 0)
+
+        first = CONFIG["latency"] + (random.uniform(0, CONFIG["jitter"]) if CONFIG["jitter"] else 0)
+        first += (usage["promptTokenCount"] - cached_tokens) * CONFIG["per_prompt_token_ms"] / 1000
+        with _stats_lock:
+            STATS["requests"] += 1
+            STATS["prompt_tokens"] += usage["promptTokenCount"]
+            STATS["cached_tokens"] += cached_tokens
+            STATS["output_tokens"] += usage["candidatesTokenCount"]
+        if m.group(2) == "streamGenerateContent":
+            return self._send_sse(body, first, CONFIG["per_token_ms"] / 1000)
+
+        time.sleep(first + usage["candidatesTokenCount"] * CONFIG["per_token_ms"] / 1000)
+        self._send_json(200, body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gemini-compatible LLM stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--latency", type=float, default=2.0, help="base latency per call (s)")
+    parser.add_argument("--per-token-ms", type=float, default=0.0, help="extra latency per output token (ms)")
+    parser.add_argument("--per-prompt-token-ms", type=float, default=0.0,
+                        help="extra latency per uncached prompt token (ms)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform random extra latency (s)")
+    parser.add_argument("--stream-chunk", type=int, default=40, help="characters per SSE chunk when streaming")
+    parser.add_argument("--canned", help="JSON file with fixed {field: xpath} mappings for analyze calls")
+    parser.add_argument("--prompt-tokens", type=int, help="fixed promptTokenCount")
+    parser.add_argument("--output-tokens", type=int, help="fixed candidatesTokenCount")
+    parser.add_argument("--max-output-tokens", type=int, help="cap output (overrides maxOutputTokens) to force truncation")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 503")
+    parser.add_argument("--retry-after", type=float, help="Retry-After seconds sent with --error-rate 503s")
+    parser.add_argument("--degrade-model", help="model-name substring answered with every other field null")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    CONFIG.update({
+        "latency": args.latency,
+        "per_token_ms": args.per_token_ms,
+        "per_prompt_token_ms": args.per_prompt_token_ms,
+        "jitter": args.jitter,
+        "prompt_tokens": args.prompt_tokens,
+        "output_tokens": args.output_tokens,
+        "error_rate": args.error_rate,
+        "max_output_tokens": args.max_output_tokens,
+        "retry_after": args.retry_after,
+        "degrade_model": args.degrade_model,
+        "stream_chunk": max(1, args.stream_chunk),
+        "verbose": args.verbose,
+        "canned": None,
+    })
+    if args.canned:
+        with open(args.canned, encoding="utf-8") as f:
+            CONFIG["canned"] = json.load(f)
+
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"[Stub] Gemini-compatible stub on http://{args.host}:{args.port} "
+          f"(latency={args.latency}s, per_token={args.per_token_ms}ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()